@@ -0,0 +1,224 @@
+"""Caches shared by the bot's subsystems."""
+
+import os
+import time
+import sys
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe in-memory cache that evicts the least recently used items.
+
+    Items older than ttl seconds (if given) are treated as missing. With max_bytes, the items are also
+    evicted once their sizes, as sizeof(value) estimates them, add up to more than max_bytes.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None, sizeof=sys.getsizeof):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, expires_at, size)
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and self.ttl is not None and item[1] < time.monotonic():
+                del self._items[key]
+                self._bytes -= item[2]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._items[key] = (value, expires_at, size)
+            self._bytes += size
+            while self._items and (len(self._items) > self.maxsize
+                                   or self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._bytes -= self._items.popitem(last=False)[1][2]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self._bytes -= item[2]
+        if item is None or self.ttl is not None and item[1] < time.monotonic():
+            return default
+        return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Return the hit/miss counters and the current size."""
+        requests = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "size": len(self._items)}
+
+
+class DiskCache:
+    """Thread-safe on-disk cache of picklable values, one file per key.
+
+    Once the files take more than max_bytes, the least recently read ones are removed.
+    Items older than ttl seconds (if given) are treated as missing.
+    Several processes may share the directory: every rescan_every writes the size of the files
+    is counted again, so that the writes of the other processes are taken into account.
+    """
+
+    def __init__(self, directory, max_bytes=100 * 2 ** 20, ttl=None, rescan_every=64):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.rescan_every = rescan_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = self._count_size()
+
+    def _path(self, key):
+        digest = hashlib.sha256(str(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _entries(self):
+        """Yield the stat results and paths of the cache files, skipping the files other processes remove meanwhile."""
+        for subdirectory in os.scandir(self.directory):
+            if subdirectory.is_dir():
+                for entry in os.scandir(subdirectory.path):
+                    if entry.name.endswith(".tmp"):
+                        continue
+                    try:
+                        yield entry.stat(), entry.path
+                    except FileNotFoundError:
+                        pass
+
+    def _count_size(self):
+        return sum(stat.st_size for stat, _ in self._entries())
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            modified = os.stat(path).st_mtime
+            if self.ttl is not None and modified + self.ttl < time.time():
+                self._remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+            # the access time orders the eviction, the modification time stays the write time for the TTL
+            os.utime(path, (time.time(), modified))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            with self._lock:
+                self.misses += 1
+            return default
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        with self._lock:
+            try:
+                self._size -= os.stat(path).st_size
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+            self._size += len(data)
+            self._writes += 1
+            if self._writes % self.rescan_every == 0:
+                self._size = self._count_size()
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self._remove(self._path(key))
+        return value
+
+    def _remove(self, path):
+        with self._lock:
+            try:
+                size = os.stat(path).st_size
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def _evict(self):
+        """Remove the least recently read files until the cache takes at most 90% of max_bytes."""
+        entries = sorted(self._entries(), key=lambda item: item[0].st_atime)
+        self._size = sum(stat.st_size for stat, _ in entries)
+        for stat, path in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._size -= stat.st_size
+            except OSError:
+                pass
+
+    def stats(self):
+        """Return the hit/miss counters and the current size in bytes."""
+        requests = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "bytes": self._size}
+
+
+class TieredCache:
+    """An LRUCache in front of a DiskCache: values are read from memory first and written to both."""
+
+    def __init__(self, memory: LRUCache, disk: DiskCache):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is None:
+            value = self.disk.get(key)
+            if value is None:
+                return default
+            self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def pop(self, key, default=None):
+        self.memory.pop(key)
+        return self.disk.pop(key, default)
+
+    def stats(self):
+        return {"memory": self.memory.stats(), "disk": self.disk.stats()}
@@ -1,6 +1,50 @@
 import re
+import os
+import gzip
+import mmap
+import struct
+import logging
+import argparse
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
 from collections import Counter
 
+from caching import LRUCache
+from language_model import NgramModel, build_model
+from setup import (
+    VOCAB_CORPUS_PATH,
+    VOCAB_PATH,
+    VOCAB_BACKEND,
+    VOCAB_TRIE_PATH,
+    CORRECTIONS_CACHE_SIZE,
+    NGRAM_RANKING,
+    NGRAM_MODEL_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+# Symmetric delete lookup: corrections up to MAX_EDIT_DISTANCE edits away,
+# deletes are only generated for the first PREFIX_LENGTH letters of a word
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+# How many corrections of a misspelled word are kept for the n-gram ranking
+CANDIDATES_LIMIT = 5
+
+# TrieVocabulary file: magic, node count, padding to 16 bytes, then the uint32 arrays
+TRIE_MAGIC = b"SCHTRIE1"
+TRIE_HEADER = struct.Struct("<8sI4x")
+
+# Vocabulary and delete index shared by all handlers of the process, see get_vocab()
+_VOCAB = None
+_DELETES_INDEX = None
+_NGRAM_MODEL = None
+_VOCAB_LOCK = threading.Lock()
+
+# check_word results for the words checked so far, see correct_many()
+CORRECTIONS_CACHE = LRUCache(maxsize=CORRECTIONS_CACHE_SIZE)
+
 
 def get_counts(text):
     t = re.split('\W+', text)
@@ -8,6 +52,290 @@ def get_counts(text):
     return count_dict
 
 
+def build_vocab(corpus_path=VOCAB_CORPUS_PATH, vocab_path=VOCAB_PATH):
+    """Count the words of the corpus and save the frequency table to disk."""
+    with open(corpus_path, encoding="utf-8") as file:
+        count_dict = get_counts(file.read())
+    save_vocab(count_dict, vocab_path)
+    return count_dict
+
+
+def save_vocab(count_dict, vocab_path=VOCAB_PATH):
+    """Save the frequency table as gzipped "word<TAB>count" lines, most frequent first."""
+    tmp_path = f"{vocab_path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+        for word, count in count_dict.most_common():
+            if word:
+                file.write(f"{word}\t{count}\n")
+    os.replace(tmp_path, vocab_path)
+
+
+def load_vocab(vocab_path=VOCAB_PATH):
+    """Load the frequency table saved by save_vocab."""
+    count_dict = Counter()
+    with gzip.open(vocab_path, "rt", encoding="utf-8") as file:
+        for line in file:
+            word, count = line.rstrip("\n").split("\t")
+            count_dict[word] = int(count)
+    return count_dict
+
+
+def _load_or_build_vocab():
+    if os.path.exists(VOCAB_PATH):
+        return load_vocab(VOCAB_PATH)
+    logger.info(f"No vocabulary at {VOCAB_PATH}, building it from {VOCAB_CORPUS_PATH}")
+    return build_vocab(VOCAB_CORPUS_PATH, VOCAB_PATH)
+
+
+def get_vocab():
+    """Return the process-wide vocabulary, loading (or building) it on first use.
+
+    Depending on VOCAB_BACKEND it is either a Counter or a TrieVocabulary.
+    """
+    global _VOCAB
+    if _VOCAB is None:
+        with _VOCAB_LOCK:
+            if _VOCAB is None:
+                if VOCAB_BACKEND == "trie":
+                    if not os.path.exists(VOCAB_TRIE_PATH):
+                        logger.info(f"No vocabulary trie at {VOCAB_TRIE_PATH}, building it")
+                        TrieVocabulary.from_counts(_load_or_build_vocab()).save(VOCAB_TRIE_PATH)
+                    _VOCAB = TrieVocabulary.load(VOCAB_TRIE_PATH)
+                else:
+                    _VOCAB = _load_or_build_vocab()
+                logger.info(f"Loaded spellcheck vocabulary ({VOCAB_BACKEND}): {len(_VOCAB)} words")
+    return _VOCAB
+
+
+def get_deletes_index():
+    """Return the process-wide SymSpellIndex over the vocabulary, building it on first use."""
+    global _DELETES_INDEX
+    if _DELETES_INDEX is None:
+        count_dict = get_vocab()
+        with _VOCAB_LOCK:
+            if _DELETES_INDEX is None:
+                _DELETES_INDEX = SymSpellIndex(count_dict)
+                logger.info(f"Built spellcheck delete index: {len(_DELETES_INDEX.deletes)} keys")
+    return _DELETES_INDEX
+
+
+def get_index():
+    """Return the structure corrections are looked up in: the trie itself or the delete index."""
+    if VOCAB_BACKEND == "trie":
+        return get_vocab()
+    return get_deletes_index()
+
+
+def get_ngram_model():
+    """Return the process-wide n-gram model, memory-mapping (or building) it on first use."""
+    global _NGRAM_MODEL
+    if _NGRAM_MODEL is None:
+        with _VOCAB_LOCK:
+            if _NGRAM_MODEL is None:
+                if os.path.exists(NGRAM_MODEL_PATH):
+                    _NGRAM_MODEL = NgramModel.load(NGRAM_MODEL_PATH)
+                else:
+                    logger.info(f"No n-gram model at {NGRAM_MODEL_PATH}, building it from {VOCAB_CORPUS_PATH}")
+                    _NGRAM_MODEL = build_model(VOCAB_CORPUS_PATH, NGRAM_MODEL_PATH)
+    return _NGRAM_MODEL
+
+
+def get_deletes(word, max_distance=MAX_EDIT_DISTANCE):
+    """Return the word and every string made from it by deleting up to max_distance letters."""
+    deletes = {word}
+    queue = [word]
+    for _ in range(max_distance):
+        next_queue = []
+        for item in queue:
+            if not item:
+                continue
+            for i in range(len(item)):
+                delete = item[:i] + item[i + 1:]
+                if delete not in deletes:
+                    deletes.add(delete)
+                    next_queue.append(delete)
+        queue = next_queue
+    return deletes
+
+
+def edit_distance(word1, word2, max_distance=MAX_EDIT_DISTANCE):
+    """Count inserts, deletes, substitutions and neighbour swaps between two words.
+
+    Stops early and returns max_distance + 1 as soon as the distance is known to exceed max_distance.
+    """
+    if abs(len(word1) - len(word2)) > max_distance:
+        return max_distance + 1
+    before_previous, previous = None, list(range(len(word2) + 1))
+    for i in range(1, len(word1) + 1):
+        current = [i] + [0] * len(word2)
+        for j in range(1, len(word2) + 1):
+            current[j] = min(previous[j] + 1,
+                             current[j - 1] + 1,
+                             previous[j - 1] + (word1[i - 1] != word2[j - 1]))
+            if i > 1 and j > 1 and word1[i - 1] == word2[j - 2] and word1[i - 2] == word2[j - 1]:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before_previous, previous = previous, current
+    return previous[-1]
+
+
+class SymSpellIndex:
+    """Maps the deletes of every vocabulary word back to the word.
+
+    Two words are at most max_distance edits apart only if they share a delete, so a lookup
+    only has to generate the deletes of the misspelled word instead of all of its edits.
+    """
+
+    def __init__(self, count_dict, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH):
+        self.count_dict = count_dict
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.deletes = {}
+        for word in count_dict:
+            if not word:
+                continue
+            for delete in get_deletes(word[:prefix_length], max_distance):
+                self.deletes.setdefault(delete, []).append(word)
+
+    def lookup(self, in_word, max_distance=None):
+        """Return (word, distance, count) for the vocabulary words close to in_word.
+
+        The closest words come first and the more frequent ones win among words at the same distance.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        distances = {}
+        for delete in get_deletes(in_word[:self.prefix_length], max_distance):
+            for word in self.deletes.get(delete, ()):
+                if word not in distances:
+                    distances[word] = edit_distance(in_word, word, max_distance)
+        candidates = [(word, distance, self.count_dict[word]) for word, distance in distances.items()
+                      if distance <= max_distance]
+        candidates.sort(key=lambda candidate: (candidate[1], -candidate[2], candidate[0]))
+        return candidates
+
+
+class TrieVocabulary:
+    """Word frequencies stored as a trie in three flat uint32 arrays.
+
+    Nodes are numbered breadth-first, so the children of node i are the nodes
+    child_start[i] to child_start[i + 1] - 1, sorted by their letter code in labels.
+    counts[i] is the frequency of the word ending at node i or 0. A loaded trie
+    memory-maps its file, so the processes of the bot share a single copy of it.
+    """
+
+    def __init__(self, labels, child_start, counts, words_count=None):
+        self.labels = labels
+        self.child_start = child_start
+        self.counts = counts
+        self.max_distance = MAX_EDIT_DISTANCE
+        self._words_count = words_count
+
+    @classmethod
+    def from_counts(cls, count_dict):
+        root = {}
+        for word, count in count_dict.items():
+            if not word:
+                continue
+            node = root
+            for letter in word:
+                node = node.setdefault(letter, {})
+            node[None] = count
+
+        labels, child_start, counts = array("I", [0]), array("I"), array("I")
+        nodes = [root]
+        for node in nodes:
+            counts.append(node.get(None, 0))
+            child_start.append(len(nodes))
+            for letter in sorted(letter for letter in node if letter is not None):
+                nodes.append(node[letter])
+                labels.append(ord(letter))
+        child_start.append(len(nodes))
+        return cls(labels, child_start, counts)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(TRIE_HEADER.pack(TRIE_MAGIC, len(self.labels)))
+            for column in (self.labels, self.child_start, self.counts):
+                array("I", column).tofile(file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, nodes_count = TRIE_HEADER.unpack_from(buffer)
+        if magic != TRIE_MAGIC:
+            raise ValueError(f"{path} is not a vocabulary trie")
+        columns = memoryview(buffer)[TRIE_HEADER.size:].cast("I")
+        labels = columns[:nodes_count]
+        child_start = columns[nodes_count:2 * nodes_count + 1]
+        counts = columns[2 * nodes_count + 1:3 * nodes_count + 1]
+        return cls(labels, child_start, counts)
+
+    def _find(self, word):
+        node = 0
+        for letter in word:
+            start, end = self.child_start[node], self.child_start[node + 1]
+            node = bisect_left(self.labels, ord(letter), start, end)
+            if node == end or self.labels[node] != ord(letter):
+                return None
+        return node
+
+    def __getitem__(self, word):
+        node = self._find(word)
+        return 0 if node is None else self.counts[node]
+
+    def __contains__(self, word):
+        return self[word] > 0
+
+    def __len__(self):
+        if self._words_count is None:
+            self._words_count = sum(1 for count in self.counts if count)
+        return self._words_count
+
+    def lookup(self, in_word, max_distance=None):
+        """Return (word, distance, count) for the vocabulary words close to in_word, like SymSpellIndex.lookup.
+
+        The trie is walked depth-first while keeping one row of the edit distance table per level
+        (a Levenshtein automaton over the trie), and the walk stops going down as soon as
+        no cell of the row can get back under max_distance.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        # cells farther than max_distance from the diagonal can't be under it, so they are not computed
+        too_far = max_distance + 1
+        candidates = []
+        first_row = list(range(len(in_word) + 1))
+        # (node, prefix, row of the parent, row of the grandparent, letter of the parent)
+        stack = [(child, "", first_row, None, None)
+                 for child in range(self.child_start[0], self.child_start[1])]
+        while stack:
+            node, prefix, previous, before_previous, previous_letter = stack.pop()
+            letter = chr(self.labels[node])
+            depth = len(prefix) + 1
+            row = [depth] + [too_far] * len(in_word)
+            for j in range(max(1, depth - max_distance), min(len(in_word), depth + max_distance) + 1):
+                value = min(row[j - 1] + 1,
+                            previous[j] + 1,
+                            previous[j - 1] + (in_word[j - 1] != letter))
+                if (before_previous is not None and j > 1
+                        and in_word[j - 1] == previous_letter and in_word[j - 2] == letter):
+                    value = min(value, before_previous[j - 2] + 1)
+                row[j] = value
+            word = prefix + letter
+            if self.counts[node] and row[-1] <= max_distance:
+                candidates.append((word, row[-1], self.counts[node]))
+            # a swap can still reach back to the parent row, so it keeps the walk going too
+            if min(row) <= max_distance or min(previous) < max_distance:
+                for child in range(self.child_start[node], self.child_start[node + 1]):
+                    stack.append((child, word, row, previous, letter))
+        candidates.sort(key=lambda candidate: (candidate[1], -candidate[2], candidate[0]))
+        return candidates
+
+
 def get_edits(in_word):
     out_word_list = []
     alphabet = 'абвгдежзийклмнуфхчцшщъыьэюя'
@@ -45,21 +373,100 @@ def get_edits(in_word):
     return out_word_list
 
 
-def get_most_likely(in_word, count_dict):
+def get_most_likely(in_word, count_dict, index=None):
+    """Return the most likely correction of the word and whether the word was already correct.
+
+    With an index (SymSpellIndex or TrieVocabulary) the correction can be up to index.max_distance edits away,
+    without it only the words from get_edits are considered.
+    """
     flag = True
-    if in_word in count_dict.keys():
+    if in_word in count_dict:
         return in_word, flag
-    elif in_word not in count_dict.keys():
+    elif index is not None:
+        flag = False
+        candidates = index.lookup(in_word)
+        most_likely_word = candidates[0][0] if candidates else in_word
+        return most_likely_word, flag
+    else:
         flag = False
         transform_list = get_edits(in_word)
         trans_quantity = 0
         most_likely_word = in_word
         for word in transform_list:
-            if word in count_dict.keys():
+            if word in count_dict:
                 if count_dict[word] > trans_quantity:
                     trans_quantity = count_dict[word]
                     most_likely_word = word
         return most_likely_word, flag
 
-# TODO: editor distance is currently only 1, improve
+
+def normalize_word(word):
+    """Return the form of the word used as the correction cache key."""
+    return unicodedata.normalize("NFC", word.strip())
+
+
+def check_word(in_word, count_dict, index):
+    """Return whether the word is correct and up to CANDIDATES_LIMIT (word, distance) corrections, best first.
+
+    Punctuation and other tokens without letters or digits are passed through as correct.
+    """
+    if in_word in count_dict or not re.search(r"\w", in_word):
+        return True, ()
+    candidates = index.lookup(in_word)[:CANDIDATES_LIMIT]
+    return False, tuple((word, distance) for word, distance, _ in candidates)
+
+
+def correct_many(tokens, context_ranking=NGRAM_RANKING):
+    """Return the get_most_likely result for every token.
+
+    Every distinct word is checked once per call, and the results are remembered in CORRECTIONS_CACHE
+    so that the words seen in the earlier messages are not checked again. With context_ranking
+    the corrections of the misspelled words are chosen by the n-gram model instead of by frequency.
+    """
+    count_dict = get_vocab()
+    index = get_index()
+    checked = {}
+    for word in dict.fromkeys(normalize_word(token) for token in tokens):
+        result = CORRECTIONS_CACHE.get(word)
+        if result is None:
+            result = check_word(word, count_dict, index)
+            CORRECTIONS_CACHE.set(word, result)
+        checked[word] = result
+    results = [(normalize_word(token), *checked[normalize_word(token)]) for token in tokens]
+    corrections = [(candidates[0][0] if candidates else word, flag) for word, flag, candidates in results]
+
+    if context_ranking and any(len(candidates) > 1 for _, _, candidates in results):
+        # rank within the words only, the model knows nothing about punctuation
+        positions = [position for position, (word, _, _) in enumerate(results) if re.match(r"\w", word)]
+        ranked = get_ngram_model().rank([corrections[position][0] for position in positions],
+                                        [results[position][2] if len(results[position][2]) > 1 else ()
+                                         for position in positions])
+        for position, word in zip(positions, ranked):
+            corrections[position] = (word, corrections[position][1])
+    return corrections
+
+
+def main():
+    """Rebuild the spellcheck vocabulary after the corpus has changed."""
+    arg_parser = argparse.ArgumentParser(description="Spellcheck vocabulary tools")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="rebuild the vocabulary from the corpus")
+    build_parser.add_argument("--corpus", default=VOCAB_CORPUS_PATH)
+    build_parser.add_argument("--output", default=VOCAB_PATH)
+    build_parser.add_argument("--trie-output", default=VOCAB_TRIE_PATH,
+                              help="also save the vocabulary as a trie for the \"trie\" backend")
+    build_parser.add_argument("--no-trie", action="store_true")
+    args = arg_parser.parse_args()
+
+    if args.command == "build":
+        count_dict = build_vocab(args.corpus, args.output)
+        print(f"Saved {len(count_dict)} words to {args.output}")
+        if not args.no_trie:
+            TrieVocabulary.from_counts(count_dict).save(args.trie_output)
+            print(f"Saved the vocabulary trie to {args.trie_output}")
+
+
+if __name__ == "__main__":
+    main()
+
 # TODO: improve output in terms of spaces between words and punctuation
@@ -69,8 +69,10 @@ LITRA_TUTORIAL = """
 /litra http://www.litra.ru/fullwork/get/woid/00796681240218949757/
 /litra http://www.litra.ru/fullwork/get/woid/00838951240144958312/page/2/
 
-Обрати внимание, что нужна именно ссылка. Я пока не могу искать произведения по названию, но когда-нибудь у меня \
-точно получится!
+Произведения, которые уже есть в моей библиотеке, можно найти и по названию или автору:
+/litra Война и мир
+
+Если я не найду произведение по названию, пришли ссылку на него, и в следующий раз оно найдётся.
 """
 
 INCORRECT_LITRA_COMMAND_MESSAGE = """
@@ -81,6 +83,11 @@ INCORRECT_LITRA_COMMAND_MESSAGE = """
 Чтобы узнать больше об этой функции, используй команду /litra_tutorial.
 """
 
+LITRA_NOT_FOUND = """
+Я не нашёл такого произведения в своей библиотеке :( Пришли ссылку на него с сайта litra.ru, например:
+/litra http://www.litra.ru/fullwork/get/woid/00796681240218949757/
+"""
+
 WIKIPEDIA_TUTORIAL = """
 Здесь всё просто! Чтобы получить текст статьи из Википедии, после команды /wikipedia \
 через пробел напиши свой запрос. Если я ничего не найду по твоему запросу или он будет пустым, то я отправлю тебе \
@@ -107,7 +114,8 @@ SUMMARIZATION_TUTORIAL = """
 текстом произведения с сайта litra.ru или статьи из Википедии.
 
 Чтобы всё получилось, после команды /summary через нижнее подчёркивание выбери метод сокращения, \
-а через пробел вставь ссылку на любую страницу текста нужного тебе произведения или напиши свой запрос в Википедию. 
+а через пробел вставь ссылку на любую страницу текста нужного тебе произведения или напиши свой запрос в Википедию. \
+Произведения из моей библиотеки можно указать и по названию.
 
 Какие методы поддерживаются и как их нужно называть?
 Luhn - алгоритм Луна;
@@ -158,6 +166,10 @@ SUGGEST_ANOTHER_ALGORITHM = """
 другой алгоритм. Чтобы узнать, какие есть, используй функцию /summary_tutorial :).
 """
 
+SESSION_EXPIRED = """
+Я уже не помню, о каком произведении шла речь :( Попроси краткое содержание ещё раз с помощью функции /summary.
+"""
+
 EMPTY_OR_NOTHING_FOUND = "Кажется, ничего не нашлось. Попробуй ещё раз!"
 
 EMPTY_SENTENCE = "Не забудь вписать предложение для проверки!"
@@ -0,0 +1,166 @@
+"""Local library of the litra.ru works, searchable by title and author.
+
+The works /litra and /summary fetch from litra.ru are kept in SQLite with their compressed texts,
+so that they are found by title and read without scraping the next time.
+"""
+
+import re
+import time
+import asyncio
+import zlib
+import sqlite3
+import logging
+import argparse
+import threading
+from collections import namedtuple
+
+from scraper import aget_litra, get_litra
+from setup import CORPUS_PATH
+
+logger = logging.getLogger(__name__)
+
+Work = namedtuple("Work", ["url", "author", "title", "text", "num_pages"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS works (
+    id INTEGER PRIMARY KEY,
+    url TEXT UNIQUE NOT NULL,
+    author TEXT NOT NULL,
+    title TEXT NOT NULL,
+    num_pages INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    text BLOB NOT NULL,
+    added_at REAL NOT NULL
+);
+-- normalized titles and authors, the rowid is the id of the work
+CREATE VIRTUAL TABLE IF NOT EXISTS works_search USING fts5(title, author, tokenize='unicode61 remove_diacritics 2');
+"""
+SEARCH_LIMIT = 5
+
+
+def normalize(text: str):
+    """Fold the case and ё, so that "Мёртвые души" is found by "мертвые"."""
+    return text.casefold().replace("ё", "е")
+
+
+def search_expression(query: str, columns=("title", "author")):
+    """Return the FTS5 expression matching the titles or authors with words starting with every word of the query."""
+    words = re.findall(r"\w+", normalize(query))
+    if not words:
+        return None
+    terms = " ".join(f'"{word}"*' for word in words)
+    return f"{{{' '.join(columns)}}} : ({terms})"
+
+
+class Corpus:
+    """SQLite store of the works, with a connection per thread."""
+
+    def __init__(self, path=CORPUS_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def add(self, work: Work):
+        """Store the work, replacing the one stored for the same URL."""
+        with self.connection as connection:
+            row = connection.execute("SELECT id FROM works WHERE url = ?", (work.url,)).fetchone()
+            if row is not None:
+                connection.execute("DELETE FROM works WHERE id = ?", row)
+                connection.execute("DELETE FROM works_search WHERE rowid = ?", row)
+            cursor = connection.execute(
+                "INSERT INTO works (url, author, title, num_pages, length, text, added_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (work.url, work.author, work.title, work.num_pages, len(work.text),
+                 zlib.compress(work.text.encode("utf-8")), time.time()))
+            connection.execute("INSERT INTO works_search (rowid, title, author) VALUES (?, ?, ?)",
+                               (cursor.lastrowid, normalize(work.title), normalize(work.author)))
+
+    @staticmethod
+    def _work(row):
+        url, author, title, text, num_pages = row
+        return Work(url, author, title, zlib.decompress(text).decode("utf-8"), num_pages)
+
+    def get(self, url: str):
+        """Return the work stored for the URL, None if there is none."""
+        row = self.connection.execute("SELECT url, author, title, text, num_pages FROM works WHERE url = ?",
+                                      (url,)).fetchone()
+        return self._work(row) if row is not None else None
+
+    def search(self, query: str, columns=("title", "author"), limit=SEARCH_LIMIT):
+        """Return (url, author, title) of the best matches of the query, exact titles first."""
+        expression = search_expression(query, columns)
+        if expression is None:
+            return []
+        rows = self.connection.execute(
+            "SELECT works.url, works.author, works.title FROM works_search JOIN works ON works.id = works_search.rowid "
+            "WHERE works_search MATCH ? ORDER BY rank LIMIT ?", (expression, limit)).fetchall()
+        return sorted(rows, key=lambda row: normalize(row[2]) != normalize(query))
+
+    def find(self, query: str, columns=("title", "author"), exact=False):
+        """Return the work that best matches the query, None if nothing does or, if exact, no title is the query."""
+        matches = self.search(query, columns, limit=SEARCH_LIMIT)
+        if exact:
+            matches = [match for match in matches if normalize(match[2]) == normalize(query)]
+        return self.get(matches[0][0]) if matches else None
+
+    def __len__(self):
+        return self.connection.execute("SELECT count(*) FROM works").fetchone()[0]
+
+
+CORPUS = Corpus()
+
+
+async def get_work(query: str, columns=("title", "author")):
+    """Return the work at the litra.ru link or with the title, from the corpus if it's there.
+
+    Links missing from the corpus are scraped and added to it. Returns None for a title that isn't in the corpus.
+    The database is queried in the loop's executor.
+    """
+    if "litra.ru" not in query:
+        return await asyncio.to_thread(CORPUS.find, query, columns)
+    work = await asyncio.to_thread(CORPUS.get, query)
+    if work is None:
+        work = Work(query, *await aget_litra(query))
+        await asyncio.to_thread(CORPUS.add, work)
+    return work
+
+
+def main():
+    """Fill the corpus with the works of a list of litra.ru links."""
+    arg_parser = argparse.ArgumentParser(description="Literature corpus tools")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="scrape and store the works of the links, one per line")
+    import_parser.add_argument("links")
+    import_parser.add_argument("--corpus", default=CORPUS_PATH)
+    search_parser = subparsers.add_parser("search", help="search the corpus by title and author")
+    search_parser.add_argument("query", nargs="+")
+    search_parser.add_argument("--corpus", default=CORPUS_PATH)
+    args = arg_parser.parse_args()
+
+    corpus = Corpus(args.corpus)
+    if args.command == "import":
+        with open(args.links, encoding="utf-8") as file:
+            links = [line.strip() for line in file if line.strip()]
+        for link in links:
+            if corpus.get(link) is not None:
+                continue
+            try:
+                corpus.add(Work(link, *get_litra(link)))
+            except Exception as error:
+                logger.warning(f"Skipped {link}: {error!r}")
+        print(f"The corpus has {len(corpus)} works")
+    elif args.command == "search":
+        for url, author, title in corpus.search(" ".join(args.query)):
+            print(f"{author} - {title}: {url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""HTTP client shared by the scrapers.
+
+Connections are pooled per host, every call has a deadline covering the retries and the body download,
+and only a few requests run against a host at once so that one slow site can't take every handler thread.
+Pages of the HTTP_CACHE_HOSTS are kept on disk and revalidated with ETag/Last-Modified when the site sends them.
+The bot's coroutines use afetch() and aget(), the same on an httpx client; the tools keep the blocking versions.
+"""
+
+import time
+import zlib
+import random
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from caching import DiskCache
+from setup import (HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF, HTTP_HOST_CONCURRENCY, HTTP_CACHE_DIR,
+                   HTTP_CACHE_MAX_BYTES, HTTP_CACHE_TTL, HTTP_CACHE_HOSTS)
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt, the rest are raised at once
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# The deadline is checked after every chunk of the body
+CHUNK_SIZE = 8 * 1024
+# Response headers kept with the cached bodies
+CACHED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+# Compressed 200 responses by URL, see get(); the TTL only applies to the pages without validators
+HTTP_CACHE = DiskCache(HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MAX_BYTES)
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_HOST_SLOTS = defaultdict(lambda: threading.BoundedSemaphore(HTTP_HOST_CONCURRENCY))
+_HOST_SLOTS_LOCK = threading.Lock()
+# created on the bot's event loop, which is the only one using them
+_ASYNC_CLIENT = None
+_ASYNC_HOST_SLOTS = defaultdict(lambda: asyncio.Semaphore(HTTP_HOST_CONCURRENCY))
+
+
+def get_session():
+    """Return the process-wide session, its connection pools keep up to HTTP_HOST_CONCURRENCY connections per host."""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=16, pool_maxsize=HTTP_HOST_CONCURRENCY, pool_block=False)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _SESSION = session
+    return _SESSION
+
+
+def get_async_client():
+    """Return the event loop's httpx client, like get_session() it keeps a few connections per host."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        limits = httpx.Limits(max_connections=16 * HTTP_HOST_CONCURRENCY,
+                              max_keepalive_connections=16 * HTTP_HOST_CONCURRENCY)
+        _ASYNC_CLIENT = httpx.AsyncClient(limits=limits, follow_redirects=True)
+    return _ASYNC_CLIENT
+
+
+async def aclose():
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.aclose()
+        _ASYNC_CLIENT = None
+
+
+def host_slots(host: str):
+    with _HOST_SLOTS_LOCK:
+        return _HOST_SLOTS[host]
+
+
+def backoff(attempt: int, response=None):
+    """Seconds to wait before the next attempt: the server's Retry-After or an exponential backoff with jitter."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+    return HTTP_BACKOFF * 2 ** attempt * (0.5 + random.random())
+
+
+def _download(url: str, timeout: float, deadline: float, **kwargs):
+    """Send one GET and read the body before the deadline (a time.monotonic() value)."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise requests.Timeout(f"{url} took longer than {timeout} s")
+    response = get_session().get(url, timeout=(min(HTTP_CONNECT_TIMEOUT, remaining), remaining), stream=True,
+                                 **kwargs)
+    with response:
+        chunks = []
+        for chunk in response.iter_content(CHUNK_SIZE):
+            chunks.append(chunk)
+            if time.monotonic() > deadline:
+                raise requests.Timeout(f"{url} took longer than {timeout} s")
+        # what response.content would have read
+        response._content = b"".join(chunks)
+    return response
+
+
+def fetch(url: str, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, **kwargs):
+    """GET the url and return the response, retrying failed connections and 429/5xx responses with backoff.
+
+    Raises requests.Timeout when the url isn't downloaded within timeout seconds, retries and waiting
+    for a free connection to the host included, and requests.HTTPError for the error statuses.
+    """
+    deadline = time.monotonic() + timeout
+    slots = host_slots(urlsplit(url).hostname)
+    if not slots.acquire(timeout=timeout):
+        raise requests.Timeout(f"no free connection to {urlsplit(url).hostname} within {timeout} s")
+    try:
+        for attempt in range(retries + 1):
+            response = None
+            try:
+                response = _download(url, timeout, deadline, **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                error = requests.HTTPError(f"{response.status_code} for {url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as exception:
+                error = exception
+            delay = backoff(attempt, response)
+            if attempt == retries or time.monotonic() + delay >= deadline:
+                raise error
+            logger.info(f"Retrying {url} in {delay:.1f} s after {error!r}")
+            time.sleep(delay)
+    finally:
+        slots.release()
+    response.raise_for_status()
+    return response
+
+
+async def _afetch(url: str, timeout: float, retries: int, **kwargs):
+    deadline = time.monotonic() + timeout
+    async with _ASYNC_HOST_SLOTS[urlsplit(url).hostname]:
+        for attempt in range(retries + 1):
+            response = None
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise httpx.TimeoutException(f"{url} took longer than {timeout} s")
+                response = await get_async_client().get(
+                    url, timeout=httpx.Timeout(remaining, connect=min(HTTP_CONNECT_TIMEOUT, remaining)), **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                error = httpx.HTTPStatusError(f"{response.status_code} for {url}", request=response.request,
+                                              response=response)
+            except httpx.TransportError as exception:
+                error = exception
+            delay = backoff(attempt, response)
+            if attempt == retries or time.monotonic() + delay >= deadline:
+                raise error
+            logger.info(f"Retrying {url} in {delay:.1f} s after {error!r}")
+            await asyncio.sleep(delay)
+    # unlike requests, httpx raises for the 304 responses to the conditional requests too
+    if response.is_error:
+        response.raise_for_status()
+    return response
+
+
+async def afetch(url: str, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, **kwargs):
+    """fetch() for coroutines, raising httpx.TimeoutException and httpx.HTTPStatusError instead."""
+    try:
+        return await asyncio.wait_for(_afetch(url, timeout, retries, **kwargs), timeout)
+    except asyncio.TimeoutError:
+        raise httpx.TimeoutException(f"{url} took longer than {timeout} s") from None
+
+
+def cacheable(url: str):
+    host = urlsplit(url).hostname or ""
+    return any(host == cached_host or host.endswith("." + cached_host) for cached_host in HTTP_CACHE_HOSTS)
+
+
+def cache_response(url: str, response):
+    if response.status_code != 200:
+        return
+    headers = {header: response.headers[header] for header in CACHED_HEADERS if header in response.headers}
+    HTTP_CACHE.set(url, {"headers": headers, "body": zlib.compress(response.content), "fetched_at": time.time()})
+
+
+def cached_response(url: str, entry):
+    """Rebuild the response from the cache entry."""
+    response = requests.Response()
+    response.url = url
+    response.status_code = 200
+    response.reason = "OK"
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = zlib.decompress(entry["body"])
+    response.from_cache = True
+    return response
+
+
+def cached_httpx_response(url: str, entry):
+    """Rebuild the httpx response from the cache entry."""
+    response = httpx.Response(200, headers=entry["headers"], content=zlib.decompress(entry["body"]),
+                              request=httpx.Request("GET", url))
+    response.from_cache = True
+    return response
+
+
+def validators(entry):
+    """Return the headers of a conditional request for the cached page, empty if the site sent no validators."""
+    headers = {}
+    if "ETag" in entry["headers"]:
+        headers["If-None-Match"] = entry["headers"]["ETag"]
+    if "Last-Modified" in entry["headers"]:
+        headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+    return headers
+
+
+def get(url: str, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, **kwargs):
+    """GET the url like fetch(), answering from HTTP_CACHE for the HTTP_CACHE_HOSTS.
+
+    A cached page with an ETag or Last-Modified is revalidated with a conditional request,
+    one without them is served for HTTP_CACHE_TTL seconds. The cached page is also served
+    when the site can't be reached. Requests with params, headers or other options aren't cached.
+    """
+    if kwargs or not cacheable(url):
+        return fetch(url, timeout, retries, **kwargs)
+    entry = HTTP_CACHE.get(url)
+    if entry is None:
+        response = fetch(url, timeout, retries)
+        cache_response(url, response)
+        return response
+
+    headers = validators(entry)
+    if not headers and time.time() - entry["fetched_at"] < HTTP_CACHE_TTL:
+        return cached_response(url, entry)
+    try:
+        response = fetch(url, timeout, retries, headers=headers)
+    except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as error:
+        if isinstance(error, requests.HTTPError) and error.response.status_code not in RETRY_STATUSES:
+            raise
+        logger.warning(f"Serving the cached {url} after {error!r}")
+        return cached_response(url, entry)
+    if response.status_code == 304:
+        entry["fetched_at"] = time.time()
+        HTTP_CACHE.set(url, entry)
+        return cached_response(url, entry)
+    cache_response(url, response)
+    return response
+
+
+async def aget(url: str, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, **kwargs):
+    """get() for coroutines, the cache files are read and written in the loop's executor."""
+    if kwargs or not cacheable(url):
+        return await afetch(url, timeout, retries, **kwargs)
+    entry = await asyncio.to_thread(HTTP_CACHE.get, url)
+    if entry is None:
+        response = await afetch(url, timeout, retries)
+        await asyncio.to_thread(cache_response, url, response)
+        return response
+
+    headers = validators(entry)
+    if not headers and time.time() - entry["fetched_at"] < HTTP_CACHE_TTL:
+        return cached_httpx_response(url, entry)
+    try:
+        response = await afetch(url, timeout, retries, headers=headers)
+    except (httpx.TransportError, httpx.HTTPStatusError) as error:
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code not in RETRY_STATUSES:
+            raise
+        logger.warning(f"Serving the cached {url} after {error!r}")
+        return cached_httpx_response(url, entry)
+    if response.status_code == 304:
+        entry["fetched_at"] = time.time()
+        await asyncio.to_thread(HTTP_CACHE.set, url, entry)
+        return cached_httpx_response(url, entry)
+    await asyncio.to_thread(cache_response, url, response)
+    return response
@@ -0,0 +1,166 @@
+"""Word n-gram model used to rank spellcheck corrections by their context."""
+
+import os
+import re
+import hashlib
+import argparse
+
+import numpy as np
+
+from setup import VOCAB_CORPUS_PATH, NGRAM_MODEL_PATH
+
+# Interpolation weights of the trigram, bigram and unigram probabilities
+TRIGRAM_WEIGHT = 0.6
+BIGRAM_WEIGHT = 0.3
+UNIGRAM_WEIGHT = 0.1
+# Log-probability a candidate loses for every edit it is away from the checked word
+DISTANCE_PENALTY = 2.0
+
+# Multiplier used to combine word ids into n-gram ids
+MIX = np.uint64(0x9E3779B97F4A7C15)
+ORDERS = ("unigram", "bigram", "trigram")
+
+
+def word_id(word):
+    """Hash the word into a non-zero 64-bit id (0 stands for "no word")."""
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+def combine(left, right):
+    """Combine arrays of (n-1)-gram ids and word ids into n-gram ids."""
+    return (left * MIX) ^ right
+
+
+def lookup_counts(keys, counts, query):
+    """Return the counts of the query ids in the sorted keys array (0 for the missing ones)."""
+    if len(keys) == 0:
+        return np.zeros(len(query), dtype=np.float64)
+    positions = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    return np.where(keys[positions] == query, counts[positions], 0).astype(np.float64)
+
+
+class NgramModel:
+    """Hashed unigram, bigram and trigram counts kept in sorted NumPy arrays."""
+
+    def __init__(self, tables, tokens_count):
+        # tables: {order: (sorted uint64 ids, uint32 counts)}
+        self.tables = tables
+        self.tokens_count = tokens_count
+
+    @classmethod
+    def build(cls, text):
+        # word -> id, every distinct word is hashed once
+        ids = {}
+
+        def token_id(word):
+            word_hash = ids.get(word)
+            if word_hash is None:
+                word_hash = ids[word] = word_id(word)
+            return word_hash
+
+        tokens = np.fromiter(map(token_id, re.findall(r"\w+", text)), dtype=np.uint64)
+        unigrams = tokens
+        bigrams = combine(tokens[:-1], tokens[1:])
+        trigrams = combine(bigrams[:-1], tokens[2:])
+        tables = {}
+        for order, grams in zip(ORDERS, (unigrams, bigrams, trigrams)):
+            keys, counts = np.unique(grams, return_counts=True)
+            tables[order] = (keys, counts.astype(np.uint32))
+        return cls(tables, len(tokens))
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for order, (keys, counts) in self.tables.items():
+            np.save(os.path.join(path, f"{order}_keys.npy"), keys)
+            np.save(os.path.join(path, f"{order}_counts.npy"), counts)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a saved model."""
+        tables = {order: (np.load(os.path.join(path, f"{order}_keys.npy"), mmap_mode="r"),
+                          np.load(os.path.join(path, f"{order}_counts.npy"), mmap_mode="r"))
+                  for order in ORDERS}
+        return cls(tables, int(tables["unigram"][1].sum()))
+
+    def count(self, order, query):
+        keys, counts = self.tables[order]
+        return lookup_counts(keys, counts, query)
+
+    def score(self, previous2, previous1, candidates, next1):
+        """Score every candidate by the log-probability of it and the next word in its context.
+
+        All arguments are uint64 word id arrays of the same length, with 0 where there is no word.
+        """
+        unigrams_total = self.tokens_count + len(self.tables["unigram"][0])
+
+        def probability(word2, word1, word):
+            trigram = self.count("trigram", combine(combine(word2, word1), word))
+            bigram_before = self.count("bigram", combine(word2, word1))
+            bigram = self.count("bigram", combine(word1, word))
+            unigram_before = self.count("unigram", word1)
+            unigram = self.count("unigram", word)
+            return (TRIGRAM_WEIGHT * np.divide(trigram, bigram_before, out=np.zeros_like(trigram),
+                                               where=bigram_before > 0)
+                    + BIGRAM_WEIGHT * np.divide(bigram, unigram_before, out=np.zeros_like(bigram),
+                                                where=unigram_before > 0)
+                    + UNIGRAM_WEIGHT * (unigram + 1) / unigrams_total)
+
+        return (np.log(probability(previous2, previous1, candidates))
+                + np.log(probability(previous1, candidates, next1)) * (next1 > 0))
+
+    def rank(self, words, candidates):
+        """Pick the best candidate for every position of the sentence in one vectorised pass.
+
+        words are the sentence words used as the context, candidates[i] is a list of
+        (word, distance) pairs for position i or empty if the word there is not in question.
+        Returns the chosen word for every position.
+        """
+        word_ids = [word_id(word) for word in words] + [0, 0]
+        rows = [(position, candidate, distance)
+                for position, position_candidates in enumerate(candidates)
+                for candidate, distance in position_candidates]
+        if not rows:
+            return list(words)
+        positions = np.array([row[0] for row in rows])
+        scores = self.score(np.array([word_ids[position - 2] if position > 1 else 0 for position in positions],
+                                     dtype=np.uint64),
+                            np.array([word_ids[position - 1] if position > 0 else 0 for position in positions],
+                                     dtype=np.uint64),
+                            np.array([word_id(row[1]) for row in rows], dtype=np.uint64),
+                            np.array([word_ids[position + 1] for position in positions], dtype=np.uint64))
+        scores -= DISTANCE_PENALTY * np.array([row[2] for row in rows])
+
+        # best candidate of every position: sort by position, then by score descending
+        order = np.lexsort((-scores, positions))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = positions[order][1:] != positions[order][:-1]
+        chosen = list(words)
+        for row in order[first]:
+            chosen[rows[row][0]] = rows[row][1]
+        return chosen
+
+
+def build_model(corpus_path=VOCAB_CORPUS_PATH, model_path=NGRAM_MODEL_PATH):
+    with open(corpus_path, encoding="utf-8") as file:
+        model = NgramModel.build(file.read())
+    model.save(model_path)
+    return model
+
+
+def main():
+    """Rebuild the n-gram model after the corpus has changed."""
+    arg_parser = argparse.ArgumentParser(description="Spellcheck n-gram model tools")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="rebuild the n-gram model from the corpus")
+    build_parser.add_argument("--corpus", default=VOCAB_CORPUS_PATH)
+    build_parser.add_argument("--output", default=NGRAM_MODEL_PATH)
+    args = arg_parser.parse_args()
+
+    if args.command == "build":
+        model = build_model(args.corpus, args.output)
+        sizes = ", ".join(f"{len(model.tables[order][0])} {order}s" for order in ORDERS)
+        print(f"Saved {sizes} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
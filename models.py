@@ -0,0 +1,77 @@
+"""Natasha models shared by the whole bot.
+
+Every model is loaded once per process, either on first use or by warmup().
+"""
+
+import time
+import logging
+import threading
+
+from natasha import MorphVocab, NewsEmbedding, NewsMorphTagger, NewsSyntaxParser, Segmenter
+
+logger = logging.getLogger(__name__)
+
+# Model name -> how to load it
+FACTORIES = {"segmenter": lambda: Segmenter(),
+             "embedding": lambda: NewsEmbedding(),
+             "morph_tagger": lambda: NewsMorphTagger(get_model("embedding")),
+             "morph_vocab": lambda: MorphVocab(),
+             "syntax_parser": lambda: NewsSyntaxParser(get_model("embedding"))}
+
+# Model name -> seconds it took to load (including the models it depends on)
+LOAD_TIMES = {}
+
+_MODELS = {}
+# Reentrant because loading a tagger or a parser loads the embedding first
+_LOCK = threading.RLock()
+
+
+def get_model(name: str):
+    """Return the model, loading it on first use."""
+    model = _MODELS.get(name)
+    if model is None:
+        with _LOCK:
+            model = _MODELS.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = FACTORIES[name]()
+                LOAD_TIMES[name] = time.perf_counter() - start
+                _MODELS[name] = model
+                logger.info(f"Loaded Natasha {name} in {LOAD_TIMES[name]:.2f} s")
+    return model
+
+
+def segmenter() -> Segmenter:
+    return get_model("segmenter")
+
+
+def morph_tagger() -> NewsMorphTagger:
+    return get_model("morph_tagger")
+
+
+def morph_vocab() -> MorphVocab:
+    return get_model("morph_vocab")
+
+
+def syntax_parser() -> NewsSyntaxParser:
+    return get_model("syntax_parser")
+
+
+def warmup(names=tuple(FACTORIES), background=True):
+    """Load the models ahead of their first use, in a background thread by default."""
+    def load():
+        for name in names:
+            get_model(name)
+        logger.info(f"Natasha models are ready: {load_times()}")
+
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name="natasha-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def load_times():
+    """Return the load time of every model loaded so far, in seconds."""
+    return {name: round(seconds, 3) for name, seconds in LOAD_TIMES.items()}
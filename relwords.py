@@ -0,0 +1,233 @@
+"""Synonyms, antonyms and related words of Russian words for /relwords.
+
+The words are looked up in a local SQLite index, filled offline from an English Wiktionary dump
+(`python relwords.py import`) and with the live Wiktionary lookups of the words missing from it.
+Words with nothing found are remembered too, for RELWORDS_NEGATIVE_TTL seconds.
+"""
+
+import re
+import bz2
+import gzip
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+import xml.etree.ElementTree as ElementTree
+
+import requests
+from bs4 import BeautifulSoup
+from wiktionaryparser import WiktionaryParser
+
+import http_client
+from caching import LRUCache
+from setup import RELWORDS_INDEX_PATH, RELWORDS_CACHE_SIZE, RELWORDS_NEGATIVE_TTL
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS relwords (
+    word TEXT PRIMARY KEY,
+    -- JSON list of {"relationshipType": ..., "words": [...]} like WiktionaryParser returns, [] if nothing found
+    related TEXT NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+# Wiktionary section headers and inline templates of the relations, by the relationshipType names of the parser
+RELATION_SECTIONS = {"Synonyms": "synonyms", "Antonyms": "antonyms", "Related terms": "related terms"}
+RELATION_TEMPLATES = {"syn": "synonyms", "ant": "antonyms"}
+HEADER = re.compile(r"^(=+)\s*([^=]+?)\s*\1\s*$", re.MULTILINE)
+LINK_TEMPLATE = re.compile(r"\{\{(?:l|link)\|ru\|([^|}]+)")
+INLINE_TEMPLATE = re.compile(r"\{\{(syn|ant)\|ru\|([^}]+)\}\}")
+WIKILINK = re.compile(r"\[\[([^\]|#]+)")
+IMPORT_BATCH = 10000
+WIKTIONARY_URL = "https://en.wiktionary.org/wiki/{}?printable=yes"
+
+_LOCAL = threading.local()
+
+
+def get_parser():
+    """Return the Wiktionary parser of the thread, it keeps the page it parses."""
+    parser = getattr(_LOCAL, "parser", None)
+    if parser is None:
+        parser = _LOCAL.parser = WiktionaryParser()
+        parser.set_default_language("russian")
+    return parser
+
+
+def fetch_related(word: str):
+    """Look the word up on Wiktionary and return the related words of its first definition.
+
+    The page is downloaded through http_client, with its deadline, and parsed like WiktionaryParser.fetch() does.
+    """
+    try:
+        response = http_client.get(WIKTIONARY_URL.format(word))
+    except requests.HTTPError as error:
+        if error.response.status_code == 404:
+            return []
+        raise
+    parser = get_parser()
+    parser.soup = BeautifulSoup(response.text.replace(">\n<", "><"), "html.parser")
+    parser.current_word = word
+    parser.clean_html()
+    entries = parser.get_word_data(parser.language)
+    try:
+        return entries[0]["definitions"][0]["relatedWords"]
+    except IndexError:
+        return []
+
+
+def russian_section(wikitext: str):
+    """Return the Russian section of a Wiktionary page, None if there's none."""
+    start = None
+    for match in HEADER.finditer(wikitext):
+        if len(match.group(1)) != 2:
+            continue
+        if start is not None:
+            return wikitext[start:match.start()]
+        if match.group(2) == "Russian":
+            start = match.end()
+    return wikitext[start:] if start is not None else None
+
+
+def parse_related(wikitext: str):
+    """Return the related words in the Russian section of the page, in the format of WiktionaryParser."""
+    section = russian_section(wikitext)
+    if section is None:
+        return []
+    related = {}
+
+    def add(relation, words):
+        # links to the other namespaces like Thesaurus: aren't words
+        words = [word.strip() for word in words if word.strip() and ":" not in word]
+        related.setdefault(relation, [])
+        related[relation].extend(word for word in words if word not in related[relation])
+
+    headers = list(HEADER.finditer(section))
+    for header, next_header in zip(headers, headers[1:] + [None]):
+        relation = RELATION_SECTIONS.get(header.group(2))
+        if relation is not None:
+            body = section[header.end():next_header.start() if next_header else len(section)]
+            add(relation, LINK_TEMPLATE.findall(body) + WIKILINK.findall(body))
+    for template, arguments in INLINE_TEMPLATE.findall(section):
+        add(RELATION_TEMPLATES[template], [argument for argument in arguments.split("|")
+                                           if "=" not in argument])
+    return [{"relationshipType": relation, "words": words} for relation, words in related.items() if words]
+
+
+def iter_dump(path: str):
+    """Yield the titles and wikitexts of the main namespace pages of a (bz2 or gzip compressed) XML dump."""
+    opener = bz2.open if path.endswith(".bz2") else gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as file:
+        title = namespace = text = root = None
+        for event, element in ElementTree.iterparse(file, events=("start", "end")):
+            if root is None:
+                root = element
+            if event == "start":
+                continue
+            tag = element.tag.rsplit("}", 1)[-1]
+            if tag == "title":
+                title = element.text
+            elif tag == "ns":
+                namespace = element.text
+            elif tag == "text":
+                text = element.text or ""
+            elif tag == "page":
+                if namespace == "0":
+                    yield title, text
+                # the parsed pages are dropped from the tree, the dumps take gigabytes
+                root.clear()
+
+
+class RelwordsIndex:
+    """SQLite index of the related words with an in-memory LRU cache in front, a connection per thread."""
+
+    def __init__(self, path=RELWORDS_INDEX_PATH, cache_size=RELWORDS_CACHE_SIZE, negative_ttl=RELWORDS_NEGATIVE_TTL):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self.cache = LRUCache(maxsize=cache_size, ttl=negative_ttl)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def get(self, word: str):
+        """Return the stored related words of the word, None if it was never looked up or nothing found expired."""
+        related = self.cache.get(word)
+        if related is not None:
+            return related
+        row = self.connection.execute("SELECT related, updated_at FROM relwords WHERE word = ?", (word,)).fetchone()
+        if row is None:
+            return None
+        related = json.loads(row[0])
+        if not related and time.time() - row[1] > self.negative_ttl:
+            return None
+        self.cache.set(word, related)
+        return related
+
+    def set(self, word: str, related):
+        with self.connection as connection:
+            connection.execute("INSERT OR REPLACE INTO relwords VALUES (?, ?, ?)",
+                               (word, json.dumps(related, ensure_ascii=False, separators=(",", ":")), time.time()))
+        self.cache.set(word, related)
+
+    def lookup(self, word: str):
+        """Return the related words of the word, looking it up on Wiktionary only if it isn't in the index."""
+        word = word.strip()
+        related = self.get(word)
+        if related is None:
+            try:
+                related = fetch_related(word)
+            except requests.RequestException as error:
+                logger.warning(f"Wiktionary lookup of {word} failed: {error!r}")
+                return []
+            self.set(word, related)
+        return related
+
+    def import_dump(self, path: str):
+        """Index the related words of every Russian entry of the dump, return the number of words with any."""
+        count = 0
+        batch = []
+        with self.connection as connection:
+            for title, text in iter_dump(path):
+                if "==Russian==" not in text:
+                    continue
+                related = parse_related(text)
+                if related:
+                    batch.append((title, json.dumps(related, ensure_ascii=False, separators=(",", ":")), time.time()))
+                if len(batch) >= IMPORT_BATCH:
+                    connection.executemany("INSERT OR REPLACE INTO relwords VALUES (?, ?, ?)", batch)
+                    count += len(batch)
+                    batch = []
+            connection.executemany("INSERT OR REPLACE INTO relwords VALUES (?, ?, ?)", batch)
+        self.cache.clear()
+        return count + len(batch)
+
+
+RELWORDS = RelwordsIndex()
+
+
+def main():
+    """Build the related words index from a Wiktionary dump, so that /relwords rarely goes online."""
+    arg_parser = argparse.ArgumentParser(description="Related words index tools")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="index an English Wiktionary pages-articles XML dump")
+    import_parser.add_argument("dump", help="enwiktionary-latest-pages-articles.xml(.bz2)")
+    import_parser.add_argument("--index", default=RELWORDS_INDEX_PATH)
+    args = arg_parser.parse_args()
+
+    if args.command == "import":
+        count = RelwordsIndex(args.index).import_dump(args.dump)
+        print(f"Indexed the related words of {count} words in {args.index}")
+
+
+if __name__ == "__main__":
+    main()
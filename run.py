@@ -3,19 +3,18 @@
 """The bot that will make your life easier."""
 
 import re
+import time
+import asyncio
 import logging
-import tempfile
 from string import punctuation
-
-from func_timeout import func_timeout, FunctionTimedOut
-from natasha import Doc, Segmenter, NewsMorphTagger, NewsEmbedding
-from wiktionaryparser import WiktionaryParser
+from concurrent.futures import ThreadPoolExecutor
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import CallbackContext, CommandHandler, Filters, MessageHandler, Updater, CallbackQueryHandler
-from telegram.constants import MAX_CAPTION_LENGTH, MAX_MESSAGE_LENGTH
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, filters
+from telegram.constants import MessageLimit
 
-from setup import PROXY, TOKEN
+import http_client
+from setup import PROXY, TOKEN, CONCURRENT_UPDATES, BLOCKING_WORKERS, SUMMARY_TIMEOUT
 
 from constant_messages import (
     HELP_MESSAGE,
@@ -26,6 +25,7 @@ from constant_messages import (
 
     LITRA_TUTORIAL,
     INCORRECT_LITRA_COMMAND_MESSAGE,
+    LITRA_NOT_FOUND,
     WIKIPEDIA_TUTORIAL,
     INCORRECT_WIKIPEDIA_QUERY,
     GOT_YOU_A_RANDOM_PAGE_ENJOY,
@@ -37,24 +37,23 @@ from constant_messages import (
     SUGGEST_LOOKING_FOR_SHORTWORK,
     NO_SHORTWORK_FOUND,
     SUGGEST_ANOTHER_ALGORITHM,
+    SESSION_EXPIRED,
 
     EMPTY_OR_NOTHING_FOUND,
 
     EMPTY_SENTENCE
 )
 
-from sentence_analysis import (
-    lemmatize,
-    morph_analyze,
-    synt_analyze
-)
 from scraper import (
-    get_litra,
+    aget_litra,
     get_shortwork_link,
     get_wikipedia
 )
-from check_dic import get_most_likely, get_counts
-from summarization import summarization
+import workers
+from corpus import CORPUS, get_work
+from relwords import RELWORDS
+from sessions import SESSIONS
+from summarization import ALGORITHMS, SUMMARY_CACHE, summary_key
 
 # Enable logging
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -62,58 +61,55 @@ logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s
 
 logger = logging.getLogger(__name__)
 
-# Natasha instances
-SEGMENTER = Segmenter()
-EMB = NewsEmbedding()
-MORPH_TAGGER = NewsMorphTagger(EMB)
-
-# Litra-button interaction
-LITRA_LINK = ""
-
 # Relationship types dictionary
 REL_TYPES = {"synonyms": "Синонимы",
              "antonyms": "Антонимы",
              "related terms": "Похожие слова"}
 
 
-def start(update: Update, context: CallbackContext):
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
-    update.message.reply_text(f"""Привет, {update.effective_user.first_name}!
+    await update.message.reply_text(f"""Привет, {update.effective_user.first_name}!
 Чтобы узнать больше о моих функциях, используй команду /help.""")
 
 
-def chat_help(update: Update, context: CallbackContext):
+async def chat_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /help is issued."""
-    update.message.reply_text(HELP_MESSAGE)
+    await update.message.reply_text(HELP_MESSAGE)
 
 
-def echo(update: Update, context: CallbackContext):
+async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Echo the user message."""
-    update.message.reply_text(update.message.text)
+    await update.message.reply_text(update.message.text)
 
 
-def error(update: Update, context: CallbackContext):
+async def error(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Log Errors caused by Updates."""
     logger.warning(f"Update {update} caused error {context.error}")
 
 
-def suggestion(update: Update, context: CallbackContext):
+def save_suggestion(username: str, text: str):
     with open("suggestions.txt", "a", encoding="utf-8") as file:
-        file.write(f"{update.effective_user['username']}\t{update.message.text.removeprefix('/suggestion ')}\n")
-    update.message.reply_text(THANKS_FOR_FEEDBACK)
+        file.write(f"{username}\t{text}\n")
+
+
+async def suggestion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.to_thread(save_suggestion, update.effective_user.username,
+                            update.message.text.removeprefix('/suggestion '))
+    await update.message.reply_text(THANKS_FOR_FEEDBACK)
     # TODO: create a database with reviews and suggestions
 
 
-def sent_tutorial(update: Update, context: CallbackContext):
+async def sent_tutorial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Explain the sentence function."""
-    update.message.reply_text(SENTENCE_TUTORIAL)
+    await update.message.reply_text(SENTENCE_TUTORIAL)
 
 
-def sent_analyze(update: Update,
-                 context: CallbackContext,
-                 lemmatization=True,
-                 morph_analysis=True,
-                 synt_analysis=True):
+async def sent_analyze(update: Update,
+                       context: ContextTypes.DEFAULT_TYPE,
+                       lemmatization=True,
+                       morph_analysis=True,
+                       synt_analysis=True):
     """Analyze the user sentence."""
     # Get parameters
     commands = re.match(r"/sentence_([A-Z]{,3})", update.message.text)
@@ -122,84 +118,69 @@ def sent_analyze(update: Update,
         if any(processed_commands):
             lemmatization, morph_analysis, synt_analysis = processed_commands
         else:
-            update.message.reply_text(INCORRECT_SYNT_COMMAND_MESSAGE)
+            await update.message.reply_text(INCORRECT_SYNT_COMMAND_MESSAGE)
             return
 
     # Get sentence
     sent = " ".join(update.message.text.split()[1:])
     if len(sent) == 0:
-        update.message.reply_text(INCORRECT_SYNT_COMMAND_MESSAGE)
+        await update.message.reply_text(INCORRECT_SYNT_COMMAND_MESSAGE)
         return
 
-    message_lemmas, message_morph, message_synt, synt_tree = None, None, None, None
-
-    # Prerocess the sentence
-    doc = Doc(sent)
-    doc.segment(SEGMENTER)
-
-    # Lemmatize
-    if lemmatization:
-        message_lemmas = lemmatize(doc)
-
-    # Morph tagging
-    if morph_analysis:
-        message_morph = morph_analyze(doc)
-
-    # Syntax parsing
-    if synt_analysis:
-        message_synt, synt_tree = synt_analyze(doc)
+    # Analyze the sentence in a worker process
+    message_lemmas, message_morph, message_synt, synt_tree = await workers.run(
+        workers.analyse_sentence, sent, lemmatization, morph_analysis, synt_analysis)
 
     # Send results
     message_text = "\n\n".join([message for message in [message_lemmas, message_morph, message_synt] if message])
 
     if synt_analysis and synt_tree:
-        if len(message_text) <= MAX_CAPTION_LENGTH:
-            update.message.reply_photo(synt_tree, caption=message_text)
+        if len(message_text) <= MessageLimit.CAPTION_LENGTH:
+            await update.message.reply_photo(synt_tree, caption=message_text)
             return
         else:
-            update.message.reply_photo(synt_tree)
+            await update.message.reply_photo(synt_tree)
 
-    if len(message_text) <= MAX_MESSAGE_LENGTH:
-        update.message.reply_text(message_text)
+    if len(message_text) <= MessageLimit.MAX_TEXT_LENGTH:
+        await update.message.reply_text(message_text)
     else:
         filename = re.sub(r"[<>:\"/\\|?*]", "", f"{sent}.txt")
-        with tempfile.TemporaryFile(mode="a+", encoding="utf-8") as file:
-            file.write(message_text)
-            file.seek(0)
-            update.message.reply_document(document=file, filename=filename)
+        await update.message.reply_document(document=message_text.encode("utf-8"), filename=filename)
 
 
-def litra_tutorial(update: Update, context: CallbackContext):
+async def litra_tutorial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Explain the litra function."""
-    update.message.reply_text(LITRA_TUTORIAL, disable_web_page_preview=True)
+    await update.message.reply_text(LITRA_TUTORIAL, disable_web_page_preview=True)
 
 
-def get_text_litra(update: Update, context: CallbackContext):
+async def get_text_litra(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Get text from litra.ru."""
-    global LITRA_LINK
-    LITRA_LINK = context.args[0]
+    if not context.args:
+        await update.message.reply_text(INCORRECT_LITRA_COMMAND_MESSAGE, disable_web_page_preview=True)
+        return
     try:
-        author, title, full_text = get_litra(LITRA_LINK)[:3]
+        work = await get_work(" ".join(context.args))
     except Exception:
-        update.message.reply_text(INCORRECT_LITRA_COMMAND_MESSAGE, disable_web_page_preview=True)
+        await update.message.reply_text(INCORRECT_LITRA_COMMAND_MESSAGE, disable_web_page_preview=True)
+        return
+    if work is None:
+        await update.message.reply_text(LITRA_NOT_FOUND, disable_web_page_preview=True)
         return
+    _, author, title, full_text = work[:4]
     filename = re.sub(r"[<>:\"/\\|?*]", "", f"{author} {title}.txt")
-    with tempfile.TemporaryFile(mode="a+", encoding="utf-8") as file:
-        file.write(full_text)
-        file.seek(0)
-        update.message.reply_document(document=file, filename=filename)
+    await update.message.reply_document(document=full_text.encode("utf-8"), filename=filename)
 
 
-def wikipedia_tutorial(update: Update, context: CallbackContext):
-    update.message.reply_text(WIKIPEDIA_TUTORIAL)
+async def wikipedia_tutorial(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(WIKIPEDIA_TUTORIAL)
 
 
-def get_text_wikipedia(update: Update, context: CallbackContext):
+async def get_text_wikipedia(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        title, content, random = get_wikipedia(context.args)
+        title, content, random = await get_wikipedia(context.args)
     except Exception as e:
         print(e)
-        update.message.reply_text(INCORRECT_WIKIPEDIA_QUERY)
+        await update.message.reply_text(INCORRECT_WIKIPEDIA_QUERY)
         return
 
     if random:
@@ -207,20 +188,23 @@ def get_text_wikipedia(update: Update, context: CallbackContext):
     else:
         caption = None
 
-    with tempfile.TemporaryFile(mode="a+", encoding="utf-8") as file:
-        file.write(content)
-        file.seek(0)
-        update.message.reply_document(document=file, filename=f"{title}.txt", caption=caption)
+    await update.message.reply_document(document=content.encode("utf-8"), filename=f"{title}.txt", caption=caption)
 
 
-def summary_tutorial(update: Update, context: CallbackContext):
+async def summary_tutorial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Explain the summarize function."""
-    update.message.reply_text(SUMMARIZATION_TUTORIAL, parse_mode="HTML", disable_web_page_preview=True)
+    await update.message.reply_text(SUMMARIZATION_TUTORIAL, parse_mode="HTML", disable_web_page_preview=True)
+
 
+async def send_summary(update: Update, summary: str, algorithm: str, author: str, title: str, caption=None):
+    """Send the summary as a txt file."""
+    await update.message.reply_document(document=summary.encode("utf-8"), filename=f"{algorithm} {author} {title}.txt",
+                                        caption=caption)
 
-def summary(update: Update, context: CallbackContext):
+
+async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Summarize user text."""
-    litra = False
+    query = " ".join(update.message.text.split()[1:])
     random = False
     # Get algorithm parameter
     algorithm = re.search(r"/summary_?([a-zA-Z]{,4})", update.message.text)
@@ -229,64 +213,98 @@ def summary(update: Update, context: CallbackContext):
     except TypeError:
         algorithm = None
 
+    # A litra link, or the exact title of a work from the library, else a Wikipedia query
+    work = None
+    if "litra.ru" not in query and query:
+        work = await asyncio.to_thread(CORPUS.find, query, ("title",), True)
+    litra = "litra.ru" in query or work is not None
+
+    # Answer repeated requests for the same book from the cache, before downloading it
+    if litra:
+        source = work.url if work is not None else query
+        cached = await asyncio.to_thread(SUMMARY_CACHE.get, summary_key(source, algorithm))
+        if cached is not None:
+            await send_summary(update, *cached)
+            return
+
     # Warn that it may take a while :)
-    update.message.reply_text("Подожди немного...")
+    await update.message.reply_text("Подожди немного...")
 
     # Get text and info
-    if "litra.ru" in update.message.text:
-        litra = True
-        global LITRA_LINK
-        LITRA_LINK = " ".join(update.message.text.split()[1:])
+    if litra:
         try:
-            author, title, text, num_pages = get_litra(LITRA_LINK)
+            if work is None:
+                work = await get_work(source)
         except Exception:
-            update.message.reply_text(INCORRECT_SUMMARY_COMMAND_MESSAGE, disable_web_page_preview=True)
+            await update.message.reply_text(INCORRECT_SUMMARY_COMMAND_MESSAGE, disable_web_page_preview=True)
             return
+        _, author, title, text, num_pages = work
+        # the buttons offered if the summary times out act on the session of the message,
+        # which fetches the short version meanwhile
+        session = SESSIONS.start(update.effective_chat.id, update.message.message_id, work)
+        SESSIONS.fetch_shortwork(session, get_shortwork(source))
     else:
         author = "Wikipedia"
         num_pages = 1
         query = update.message.text.split()[1:]
-        title, text, random = get_wikipedia(query)
+        title, text, random = await get_wikipedia(query)
         text = re.sub(r"={2,}.+={2,}", "\n", text)
+        source = f"wikipedia:{title}"
+
+    # Create caption for random articles
+    if random:
+        caption = GOT_YOU_A_RANDOM_PAGE_ENJOY
+    else:
+        caption = None
+
+    # the litra summaries were looked up before downloading the text
+    key = summary_key(source, algorithm)
+    if not litra:
+        cached = await asyncio.to_thread(SUMMARY_CACHE.get, key)
+        if cached is not None:
+            await send_summary(update, *cached, caption=caption)
+            return
 
     # Try summarizing else suggest options
     try:
-        summary, algorithm = func_timeout(90, summarization, args=(text, num_pages * 3, "russian", algorithm))
-    except FunctionTimedOut:
+        deadline = time.time() + SUMMARY_TIMEOUT
+        (summary, used_algorithm, used_key), _ = await workers.SUMMARY_EXECUTOR.arun(
+            workers.summarize, (text, num_pages * 3, "russian", algorithm, num_pages, source, deadline),
+            SUMMARY_TIMEOUT, affinity=source)
+    except workers.JobTimeout:
         if litra:
-            keyboard = [[InlineKeyboardButton("Да, поищи сокращённую версию", callback_data="True"),
-                         InlineKeyboardButton("Нет, спасибо", callback_data="False")]]
+            message_id = update.message.message_id
+            keyboard = [[InlineKeyboardButton("Да, поищи сокращённую версию", callback_data=f"True {message_id}"),
+                         InlineKeyboardButton("Нет, спасибо", callback_data=f"False {message_id}")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            update.message.reply_text(SUGGEST_LOOKING_FOR_SHORTWORK, reply_markup=reply_markup)
+            await update.message.reply_text(SUGGEST_LOOKING_FOR_SHORTWORK, reply_markup=reply_markup)
         else:
-            update.message.reply_text(f"""Извини, у меня не получилось справиться со статьёй {title}! Попробуй \
+            await update.message.reply_text(f"""Извини, у меня не получилось справиться со статьёй {title}! Попробуй \
 использовать другой алгоритм или другой текст.""")
         return
 
-    # Create caption for random articles
-    if random:
-        caption = GOT_YOU_A_RANDOM_PAGE_ENJOY
-    else:
-        caption = None
-
-    # Create a txt file with summary and send results
-    with tempfile.TemporaryFile(mode="a+", encoding="utf-8") as file:
-        file.write(summary)
-        file.seek(0)
-        update.message.reply_document(document=file, filename=f"{algorithm} {author} {title}.txt", caption=caption)
+    # Remember the results and send them
+    if litra:
+        SESSIONS.discard(update.effective_chat.id, update.message.message_id)
+    # the worker may have switched to a faster algorithm, the summary is kept for the one it was made with,
+    # and for the automatic choice if that was asked for
+    keys = [summary_key(source, used_key)]
+    if algorithm not in ALGORITHMS:
+        keys.append(key)
+    for cache_key in keys:
+        await asyncio.to_thread(SUMMARY_CACHE.set, cache_key, (summary, used_algorithm, author, title))
+    await send_summary(update, summary, used_algorithm, author, title, caption)
     # TODO: process user file
     # TODO: shorten and simplify this function
 
 
-def relwords(update: Update, context: CallbackContext):
+async def relwords(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Give synonyms for the user word."""
     word = update.message.text.removeprefix("/relwords ")
-    parser = WiktionaryParser()
-    parser.set_default_language("russian")
-    try:
-        related_words = parser.fetch(word)[0]["definitions"][0]["relatedWords"]
-    except IndexError:
-        update.message.reply_text(EMPTY_OR_NOTHING_FOUND)
+    # the index is on disk and the words missing from it are looked up on Wiktionary with requests
+    related_words = await asyncio.to_thread(RELWORDS.lookup, word)
+    if not related_words:
+        await update.message.reply_text(EMPTY_OR_NOTHING_FOUND)
         return
     message_text = ""
     for reltypes in related_words:
@@ -296,34 +314,24 @@ def relwords(update: Update, context: CallbackContext):
             if no_english:
                 words.append(no_english)
         words = ", ".join(words)
-        message_text += f"""{REL_TYPES[reltypes["relationshipType"]]}:\n{words}\n\n"""
-    update.message.reply_text(message_text)
-    # TODO: not create an instance of parser every time
+        relationship_type = REL_TYPES.get(reltypes["relationshipType"], reltypes["relationshipType"])
+        message_text += f"""{relationship_type}:\n{words}\n\n"""
+    await update.message.reply_text(message_text)
 
 
-def spellcheck_tutorial(update: Update, context: CallbackContext):
+async def spellcheck_tutorial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Explain the spellcheck function."""
-    update.message.reply_text(SPELLCHECK_TUTORIAL, parse_mode="HTML")
+    await update.message.reply_text(SPELLCHECK_TUTORIAL, parse_mode="HTML")
 
 
-def spellchecker(update: Update, context: CallbackContext):
+async def spellchecker(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Checks spelling in the given sentence."""
     sent = update.message.text.removeprefix("/spellcheck ")
     if sent == update.message.text:
-        update.message.reply_text(EMPTY_SENTENCE)
+        await update.message.reply_text(EMPTY_SENTENCE)
         return
     new_sent = ""
-    doc = Doc(sent)
-    doc.segment(SEGMENTER)
-    doc.tag_morph(MORPH_TAGGER)
-    tokens = [token.text for token in doc.tokens]
-
-    vocab = open("lifenews2.txt", encoding="utf-8").read()
-    counts_vocab = get_counts(vocab)
-    # TODO: don't load vocab every time
-
-    for word in tokens:
-        right_word, flag = get_most_likely(word, counts_vocab)
+    for word, right_word, flag in await workers.run(workers.spellcheck, sent):
         if not flag:
             right_word = "*" + right_word + "*"
         if word in punctuation:
@@ -331,71 +339,95 @@ def spellchecker(update: Update, context: CallbackContext):
         right_word += " "
         new_sent += right_word
 
-    update.message.reply_text(f"Проверенное предложение: {new_sent}\n", parse_mode="Markdown")
+    await update.message.reply_text(f"Проверенное предложение: {new_sent}\n", parse_mode="Markdown")
 
 
-def button_shortwork(update: Update, context: CallbackContext):
-    query = update.callback_query
-    global LITRA_LINK
-    if query.data == "True":
-        try:
-            author, title, text = get_litra(get_shortwork_link(LITRA_LINK))[:3]
-        except Exception:
-            context.bot.send_message(chat_id=str(update.effective_chat['id']), text=NO_SHORTWORK_FOUND)
-            return
-    else:
-        context.bot.send_message(chat_id=str(update.effective_chat['id']), text=SUGGEST_ANOTHER_ALGORITHM)
+async def get_shortwork(url: str):
+    """Return the author, title and text of the short version of the litra work."""
+    return (await aget_litra(await get_shortwork_link(url)))[:3]
+
+
+async def button_shortwork(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    answer, *message_id = update.callback_query.data.split()
+    # the buttons sent before the sessions carry no message id
+    session = SESSIONS.get(update.effective_chat.id, int(message_id[0])) if message_id else None
+    if answer == "False":
+        if session is not None:
+            SESSIONS.discard(*session.key)
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=SUGGEST_ANOTHER_ALGORITHM)
+        return
+    if session is None:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=SESSION_EXPIRED)
+        return
+
+    # the prefetched short version, pressing the button again sends it without fetching it again
+    if not session.fetching_shortwork():
+        SESSIONS.fetch_shortwork(session, get_shortwork(session.work.url))
+    # the fetch belongs to the session: it's shielded from this handler, but the session cancels it
+    # when it expires or is replaced
+    try:
+        author, title, text = await asyncio.shield(session.shortwork)
+    except asyncio.CancelledError:
+        if not session.shortwork.cancelled():
+            raise
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=NO_SHORTWORK_FOUND)
+        return
+    except Exception:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=NO_SHORTWORK_FOUND)
         return
 
-    with tempfile.TemporaryFile(mode="a+", encoding="utf-8") as file:
-        file.write(text)
-        file.seek(0)
-        context.bot.send_document(chat_id=str(update.effective_chat['id']), document=file, filename=f"{author} {title}.txt")
-    # TODO: don't use global litra link because users might get someone else's queries
+    await context.bot.send_document(chat_id=update.effective_chat.id, document=text.encode("utf-8"),
+                                    filename=f"{author} {title}.txt")
+
+
+async def post_init(application: Application):
+    # the blocking calls of the handlers share a bounded pool instead of taking a thread per update
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking"))
+
+
+async def post_shutdown(application: Application):
+    SESSIONS.shutdown()
+    await http_client.aclose()
 
 
 def main():
     """Where the magic happens"""
 
-    # Connect via socks proxy
-    request_kwargs = {
-        "proxy_url": PROXY
-    }
+    # Start the NLP worker processes before any other thread, they load their models once
+    workers.start()
 
-    updater = Updater(TOKEN, request_kwargs=request_kwargs, use_context=True)
+    # Connect via socks proxy, handle the updates of different chats concurrently on one event loop
+    application = (Application.builder().token(TOKEN).proxy(PROXY).get_updates_proxy(PROXY)
+                   .concurrent_updates(CONCURRENT_UPDATES).post_init(post_init).post_shutdown(post_shutdown).build())
 
     # on different commands - answer in Telegram
-    updater.dispatcher.add_handler(CommandHandler("start", start))
-    updater.dispatcher.add_handler(CommandHandler("help", chat_help))
-    updater.dispatcher.add_handler(CommandHandler("suggestion", suggestion))
-    updater.dispatcher.add_handler(CommandHandler("sentence_tutorial", sent_tutorial))
-    updater.dispatcher.add_handler(MessageHandler(Filters.regex(r"(/sentence_?[A-Z]{,3})"),
-                                                  sent_analyze))
-    updater.dispatcher.add_handler(CommandHandler("litra_tutorial", litra_tutorial))
-    updater.dispatcher.add_handler(CommandHandler("litra", get_text_litra))
-    updater.dispatcher.add_handler(CommandHandler("summary_tutorial", summary_tutorial))
-    updater.dispatcher.add_handler(MessageHandler(Filters.regex(r"(/summary_?[a-zA-Z]{,4})"), summary))
-    updater.dispatcher.add_handler(CommandHandler("wikipedia_tutorial", wikipedia_tutorial))
-    updater.dispatcher.add_handler(CommandHandler("wikipedia", get_text_wikipedia))
-    updater.dispatcher.add_handler(CommandHandler("relwords", relwords))
-    updater.dispatcher.add_handler(CommandHandler("spellcheck_tutorial", spellcheck_tutorial))
-    updater.dispatcher.add_handler(CommandHandler("spellcheck", spellchecker))
-
-    updater.dispatcher.add_handler(CallbackQueryHandler(button_shortwork, pattern='(True|False)'))
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", chat_help))
+    application.add_handler(CommandHandler("suggestion", suggestion))
+    application.add_handler(CommandHandler("sentence_tutorial", sent_tutorial))
+    application.add_handler(MessageHandler(filters.Regex(r"(/sentence_?[A-Z]{,3})"), sent_analyze))
+    application.add_handler(CommandHandler("litra_tutorial", litra_tutorial))
+    application.add_handler(CommandHandler("litra", get_text_litra))
+    application.add_handler(CommandHandler("summary_tutorial", summary_tutorial))
+    application.add_handler(MessageHandler(filters.Regex(r"(/summary_?[a-zA-Z]{,4})"), summary))
+    application.add_handler(CommandHandler("wikipedia_tutorial", wikipedia_tutorial))
+    application.add_handler(CommandHandler("wikipedia", get_text_wikipedia))
+    application.add_handler(CommandHandler("relwords", relwords))
+    application.add_handler(CommandHandler("spellcheck_tutorial", spellcheck_tutorial))
+    application.add_handler(CommandHandler("spellcheck", spellchecker))
+
+    application.add_handler(CallbackQueryHandler(button_shortwork, pattern=r"^(True|False)( \d+)?$"))
 
     # on noncommand i.e message - echo the message on Telegram
-    updater.dispatcher.add_handler(MessageHandler(Filters.text, echo))
+    application.add_handler(MessageHandler(filters.TEXT, echo))
 
     # log all errors
-    updater.dispatcher.add_error_handler(error)
-
-    # Start the Bot
-    updater.start_polling()
+    application.add_error_handler(error)
 
-    # Run the bot until you press Ctrl-C or the process receives SIGINT,
-    # SIGTERM or SIGABRT. This should be used most of the time, since
-    # start_polling() is non-blocking and will stop the bot gracefully.
-    updater.idle()
+    # Run the bot until you press Ctrl-C or the process receives SIGINT, SIGTERM or SIGABRT
+    application.run_polling()
+    workers.shutdown()
 
 
 if __name__ == "__main__":
@@ -407,7 +439,6 @@ if __name__ == "__main__":
 # TODO: not use BaseExceptions but understand what is going wrong and why
 # TODO: improve code readability, modulate
 # TODO: handle pylint warnings
-# TODO: process multiple users
 # TODO: make user be able to stop the bot
 # TODO: add some fun apis
 # TODO: customizable environment (e.g. custom timeout in summarization)
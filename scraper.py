@@ -1,50 +1,97 @@
 import re
-import random as rnd
+import asyncio
 
-import requests
-import wikipedia
-from wikipedia.exceptions import PageError, DisambiguationError
-from bs4 import BeautifulSoup
+from lxml import etree, html
 
-wikipedia.set_lang("ru")
+import http_client
+from wiki_client import WIKIPEDIA
 
+LITRA_URL = "http://www.litra.ru"
+DOWNLOAD_LINK_TEXT = re.compile(r"Скачать полное произведение|Скачать краткое содержание|Скачать сочинение")
+SHORTWORK_LINK_TEXT = re.compile(r"Краткое содержание")
+# Characters fed to the parser at once while looking for the headers and links of a page
+FEED_SIZE = 64 * 1024
+COPYRIGHT_OLD = """2008 
+Created by Litra.RU Team / 
+"""
+COPYRIGHT_NEW = """
+Created by Litra.RU Team
+"""
 
-def get_litra(url: str):
-    given_page = requests.get(url)
-    html_soup = BeautifulSoup(given_page.text, 'lxml')
 
-    num_pages = re.search(r"\[\d+/(\d+)\]", html_soup.find("h1").get_text())
+def scan_page(page: str, headers=("h1", "h2"), link_text=None):
+    """Return {header tag: text} of the first headers and {"a": href} of the first link whose text matches link_text.
+
+    The page is fed to the parser in chunks and parsing stops as soon as everything is found.
+    Raises ValueError if something isn't on the page.
+    """
+    wanted = set(headers) | ({"a"} if link_text is not None else set())
+    parser = etree.HTMLPullParser(events=("end",), tag=tuple(wanted))
+    found = {}
+
+    def read_events():
+        for _, element in parser.read_events():
+            text = "".join(element.itertext())
+            if element.tag == "a":
+                if "a" not in found and link_text.search(text):
+                    found["a"] = element.get("href")
+            elif element.tag not in found:
+                found[element.tag] = text
+
+    for start in range(0, len(page), FEED_SIZE):
+        parser.feed(page[start:start + FEED_SIZE])
+        read_events()
+        if len(found) == len(wanted):
+            return found
+    parser.close()
+    read_events()
+    if len(found) < len(wanted):
+        raise ValueError(f"no {', '.join(sorted(wanted - set(found)))} on the page")
+    return found
+
+
+def parse_text_page(page: str):
+    """Return the title and the text of a litra.ru download page."""
+    root = html.document_fromstring(page)
+    header = root.find(".//h1")
+    title = header.text_content()
+    # the links go in one pass, together with the scripts and styles that aren't part of the text;
+    # the elements are emptied rather than dropped so that their tails stay separate lines, like in get_text("\n")
+    for element in [header, *root.iter("a", "script", "style")]:
+        element.clear(keep_tail=True)
+    full_text = re.sub(r"\n{2,}", "\n", "\n".join(root.body.itertext()))
+    return title, full_text.replace(COPYRIGHT_OLD, COPYRIGHT_NEW)
+
+
+def read_work_page(page: str):
+    """Return the author, the number of pages and the download link of a litra.ru work page."""
+    work_page = scan_page(page, link_text=DOWNLOAD_LINK_TEXT)
+
+    num_pages = re.search(r"\[\d+/(\d+)\]", work_page["h1"])
     if num_pages:
         num_pages = int(num_pages.group(1))
     else:
         num_pages = 1
 
-    author = html_soup.find("h2").get_text().split(" /  ")[1]
+    author = work_page["h2"].split(" /  ")[1]
 
-    download_link = "http://www.litra.ru" \
-                    + html_soup.find("a",
-                                     text=re.compile(r"Скачать полное произведение|Скачать краткое содержание|Скачать "
-                                                     r"сочинение"))["href"]
+    return author, num_pages, LITRA_URL + work_page["a"]
 
-    full_text_page = requests.get(download_link)
-    html_soup = BeautifulSoup(full_text_page.text, 'lxml')
-    title = html_soup.find("h1").get_text()
-    html_soup.h1.decompose()
-    for _ in html_soup.find_all("a"):
-        html_soup.a.decompose()
-    copyright_old = """2008 
-Created by Litra.RU Team / 
-"""
-    copyright_new = """
-Created by Litra.RU Team
-"""
-    full_text = re.sub(r"\n{2,}", "\n", html_soup.find("body").get_text(separator="\n")).replace(copyright_old,
-                                                                                                 copyright_new)
+
+def get_litra(url: str):
+    author, num_pages, download_link = read_work_page(http_client.get(url).text)
+    title, full_text = parse_text_page(http_client.get(download_link).text)
 
     return author, title, full_text, num_pages
 
 
-# TODO: search by title, not only by link
+async def aget_litra(url: str):
+    """get_litra() for coroutines, the download page of up to several megabytes is parsed in the loop's executor."""
+    author, num_pages, download_link = read_work_page((await http_client.aget(url)).text)
+    text_page = (await http_client.aget(download_link)).text
+    title, full_text = await asyncio.to_thread(parse_text_page, text_page)
+
+    return author, title, full_text, num_pages
 
 
 def wikisource(query: str):
@@ -54,59 +101,25 @@ def wikisource(query: str):
 # TODO: get texts from wikisource
 
 
-def get_shortwork_link(url: str):
-    given_page = requests.get(url)
-    html_soup = BeautifulSoup(given_page.text, 'lxml')
-    shortwork_link = "http://www.litra.ru" \
-                     + html_soup.find("a",
-                                      text=re.compile(r"Краткое содержание"))["href"]
+async def get_shortwork_link(url: str):
+    page = (await http_client.aget(url)).text
+    shortwork_link = LITRA_URL + scan_page(page, headers=(), link_text=SHORTWORK_LINK_TEXT)["a"]
     return shortwork_link
 
 
-def disambiguation_error(query: str):
-    page = requests.get(f"https://ru.wikipedia.org/wiki/{query}")
-    html_soup = BeautifulSoup(page.text, 'lxml')
-    main_body = html_soup.find("div", class_="mw-parser-output")
-    options = main_body.find_all("li", class_=None)
-    possible_headers = []
-    for option in options:
-        try:
-            title = option.a.attrs["title"]
-        except (AttributeError, KeyError):
-            continue
-        if all(item not in title for item in ["(страница отсутствует)", "(значения)"]):
-            possible_headers.append(title)
-    return possible_headers
-
-
-def get_wikipedia(query: list, random=False):
+async def get_wikipedia(query: list, random=False):
     if len(query) == 0:
-        query = [wikipedia.random()]
-        random = True
-    elif "ru.wikipedia.org" in query[0]:
-        page = requests.get(query[0])
-        query = [BeautifulSoup(page.text, 'lxml').find("h1").get_text()]
-    query = " ".join(query)
-    try:
-        page = wikipedia.page(query, auto_suggest=False)
-    except PageError:
-        try:
-            page = wikipedia.page(query)
-        except PageError:
-            return get_wikipedia([wikipedia.random()], random=True)
-        except DisambiguationError as error:
-            query = rnd.choice(disambiguation_error(error.title))
-            page = wikipedia.page(query, auto_suggest=False)
-    except DisambiguationError:
-        query = rnd.choice(disambiguation_error(query))
-        page = wikipedia.page(query, auto_suggest=False)
-    title = page.title
-    content = page.content
+        return *await WIKIPEDIA.random_article(), True
+    elif "wikipedia.org" in query[0]:
+        query = query[:1]
+    article = await WIKIPEDIA.article(" ".join(query))
+    if article is None:
+        return *await WIKIPEDIA.random_article(), True
+    title, content = article
     return title, content, random
 
 
 # TODO: include media? return as pdf? at least format the result better
-# TODO: the function seems too crowded, reformat, simplify, or redo
 # TODO: when loading pages from wiki, don't resolve disambiguation randomly but suggest options via buttons
 # TODO: when loading texts from wiki, disambiguation might be on multiple levels (ход - чёрный ход),
 #  come up with a solution for that
@@ -0,0 +1,80 @@
+"""Compare the litra.ru page parsing of get_litra with the previous BeautifulSoup version on saved pages."""
+
+import re
+import time
+import argparse
+
+from bs4 import BeautifulSoup
+
+import http_client
+from scraper import (
+    COPYRIGHT_NEW,
+    COPYRIGHT_OLD,
+    DOWNLOAD_LINK_TEXT,
+    LITRA_URL,
+    parse_text_page,
+    scan_page
+)
+
+
+def parse_work_page_bs4(page: str):
+    html_soup = BeautifulSoup(page, 'lxml')
+    header = html_soup.find("h1").get_text()
+    author_line = html_soup.find("h2").get_text()
+    download_href = html_soup.find("a", string=DOWNLOAD_LINK_TEXT)["href"]
+    return header, author_line, download_href
+
+
+def parse_text_page_bs4(page: str):
+    html_soup = BeautifulSoup(page, 'lxml')
+    title = html_soup.find("h1").get_text()
+    html_soup.h1.decompose()
+    for _ in html_soup.find_all("a"):
+        html_soup.a.decompose()
+    full_text = re.sub(r"\n{2,}", "\n", html_soup.find("body").get_text(separator="\n")).replace(COPYRIGHT_OLD,
+                                                                                                 COPYRIGHT_NEW)
+    return title, full_text
+
+
+def parse_work_page(page: str):
+    found = scan_page(page, link_text=DOWNLOAD_LINK_TEXT)
+    return found["h1"], found["h2"], found["a"]
+
+
+def best_time(function, page: str, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(page)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("work_page", help="saved work page, the one /litra gets a link to")
+    arg_parser.add_argument("text_page", help="saved download page with the full text")
+    arg_parser.add_argument("--save", metavar="URL", help="download the pages of this work page URL first")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    if args.save:
+        work_page = http_client.get(args.save).text
+        text_page = http_client.get(LITRA_URL + scan_page(work_page, (), DOWNLOAD_LINK_TEXT)["a"]).text
+        for path, page in [(args.work_page, work_page), (args.text_page, text_page)]:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(page)
+
+    for path, old, new in [(args.work_page, parse_work_page_bs4, parse_work_page),
+                           (args.text_page, parse_text_page_bs4, parse_text_page)]:
+        with open(path, encoding="utf-8") as file:
+            page = file.read()
+        old_time, old_result = best_time(old, page, args.repeat)
+        new_time, new_result = best_time(new, page, args.repeat)
+        same = "same result" if old_result == new_result else "DIFFERENT RESULTS"
+        print(f"{path} ({len(page) / 2 ** 20:.1f} MB): BeautifulSoup {old_time * 1000:.0f} ms, "
+              f"lxml {new_time * 1000:.0f} ms, {old_time / new_time:.1f}x faster, {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,17 @@
-import requests
-from ipymarkup import format_dep_markup
-from natasha import MorphVocab, NewsEmbedding, NewsMorphTagger, NewsSyntaxParser, Doc
-from setup import HCTI_API_KEY, HCTI_API_USER_ID
+import time
+import hashlib
+import unicodedata
 
-# Natasha instances
-EMB = NewsEmbedding()
-MORPH_TAGGER = NewsMorphTagger(EMB)
-MORPH_VOCAB = MorphVocab()
-SYNTAX_PARSER = NewsSyntaxParser(EMB)
+from natasha import Doc
 
-# HCTI
-HCTI_API_ENDPOINT = "https://hcti.io/v1/image"
+import models
+from caching import DiskCache, LRUCache, TieredCache
+from syntax_tree import render_synt_tree
+from setup import ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_MAX_BYTES, ANALYSIS_CACHE_TTL
+
+# SentencePipeline.run results by analysis_key
+ANALYSIS_CACHE = TieredCache(LRUCache(maxsize=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL),
+                             DiskCache(ANALYSIS_CACHE_DIR, max_bytes=ANALYSIS_CACHE_MAX_BYTES, ttl=ANALYSIS_CACHE_TTL))
 
 POS_TAGS = {"ADJ": "прилагательное", "ADP": "предлог/послелог", "ADV": "наречие", "AUX": "вспом. глагол",
             "CCONJ": "сочинительный союз", "DET": "артикль", "INTJ": "междометие", "NOUN": "существительное",
@@ -41,18 +42,39 @@ FEATS_TAGS = {"Animacy": {"Anim": "одуш.", "Inan": "неодуш."},
               "NumForm": {"Digit": "арабская запись числа"}}
 
 
-def lemmatize(doc: Doc):
-    doc.tag_morph(MORPH_TAGGER)
+def analysis_key(sent: str, stages: str):
+    """Hash the sentence (with normalized whitespace) together with the requested stages."""
+    normalized = unicodedata.normalize("NFC", " ".join(sent.split()))
+    return hashlib.sha256(f"{stages}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+def tag_morph(doc: Doc):
+    """Tag the morphology of the doc unless it is already tagged."""
+    if any(token.pos is None for token in doc.tokens):
+        doc.tag_morph(models.morph_tagger())
+
+
+def lemmatize_tokens(doc: Doc):
+    """Lemmatize the tagged doc unless it is already lemmatized."""
     for token in doc.tokens:
-        token.lemmatize(MORPH_VOCAB)
+        if token.lemma is None:
+            token.lemmatize(models.morph_vocab())
+
+
+def parse_syntax(doc: Doc):
+    """Parse the syntax of the doc unless it is already parsed."""
+    if any(token.head_id is None for token in doc.tokens):
+        doc.parse_syntax(models.syntax_parser())
+
+
+def format_lemmas(doc: Doc):
     lemmas = [f"{id + 1}) {token.text} → {token.lemma}" for id, token in enumerate(doc.tokens) if
               not token.pos == "PUNCT"]
     message = "Токены и леммы:\n{}".format("\n".join(lemmas))
     return message
 
 
-def morph_analyze(doc: Doc):
-    doc.tag_morph(MORPH_TAGGER)
+def format_morph(doc: Doc):
     morph_tags = []
     for ind, token in enumerate(doc.tokens):
         if not token.pos == "PUNCT":
@@ -62,12 +84,9 @@ def morph_analyze(doc: Doc):
     return message
 
 
-def synt_analyze(doc: Doc):
-    # Tokenize
+def format_synt(doc: Doc):
+    """Return the syntax message, the tokens and the (head, dependent, relation) arcs of the tree."""
     tokens = [token.text for token in doc.tokens]
-
-    # Analyze
-    doc.parse_syntax(SYNTAX_PARSER)
     synt_spans, synt_tags = [], []
     for ind, token in enumerate(doc.tokens):
         head_id = int(token.head_id.split("_")[1]) - 1
@@ -82,19 +101,90 @@ def synt_analyze(doc: Doc):
         else:
             synt_tags.append(f"{ind + 1}) {token.text} — {relation}")
 
-    # Send results
     message = "Синтаксический разбор:\n{}".format("\n".join(synt_tags))
+    return message, tokens, synt_spans
+
+
+def draw_synt_tree(tokens: list, synt_spans: list):
+    """Return the PNG image bytes of the syntax tree or None if it can't be drawn."""
+    if not tokens:
+        return None
+    return render_synt_tree(tokens, synt_spans)
+
 
-    # Draw the syntax tree
-    try:
-        data = {"html": "\n".join(list(format_dep_markup(tokens, synt_spans)))}
-    except ValueError:
-        return message, None
+def lemmatize(doc: Doc):
+    tag_morph(doc)
+    lemmatize_tokens(doc)
+    return format_lemmas(doc)
+
+
+def morph_analyze(doc: Doc):
+    tag_morph(doc)
+    return format_morph(doc)
 
-    image = requests.post(url=HCTI_API_ENDPOINT, data=data, auth=(HCTI_API_USER_ID, HCTI_API_KEY))
-    image_url = image.json()['url']
-    return message, image_url
+
+def synt_analyze(doc: Doc):
+    parse_syntax(doc)
+    message, tokens, synt_spans = format_synt(doc)
+    return message, draw_synt_tree(tokens, synt_spans)
     # TODO: translate tags
-    # TODO: find another service so that there is no query limit
     # TODO: object oriented version
     # TODO: school mode and scientist mode
+
+
+class SentencePipeline:
+    """Runs the requested analyses of a sentence, every Natasha stage at most once.
+
+    The results are looked up in and saved to the cache (None turns caching off).
+    The time every stage took is kept in timings after run().
+    """
+
+    def __init__(self, lemmatization=True, morph_analysis=True, synt_analysis=True, cache=ANALYSIS_CACHE):
+        self.lemmatization = lemmatization
+        self.morph_analysis = morph_analysis
+        self.synt_analysis = synt_analysis
+        self.stages = "".join(stage for stage, requested in zip("LMS", (lemmatization, morph_analysis, synt_analysis))
+                              if requested)
+        self.cache = cache
+        self.timings = {}
+
+    def _stage(self, name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.timings[name] = time.perf_counter() - start
+        return result
+
+    def run(self, sent: str):
+        """Return the lemmas, morphology and syntax messages and the syntax tree (None if not requested)."""
+        self.timings = {}
+        if self.cache is not None:
+            key = analysis_key(sent, self.stages)
+            result = self._stage("cache", self.cache.get, key)
+            if result is not None:
+                return result
+
+        message_lemmas, message_morph, message_synt, synt_tree = None, None, None, None
+
+        # Natasha stages
+        doc = Doc(sent)
+        self._stage("segment", doc.segment, models.segmenter())
+        if self.lemmatization or self.morph_analysis:
+            self._stage("tag_morph", tag_morph, doc)
+        if self.lemmatization:
+            self._stage("lemmatize", lemmatize_tokens, doc)
+        if self.synt_analysis:
+            self._stage("parse_syntax", parse_syntax, doc)
+
+        # Formatting
+        if self.lemmatization:
+            message_lemmas = self._stage("format_lemmas", format_lemmas, doc)
+        if self.morph_analysis:
+            message_morph = self._stage("format_morph", format_morph, doc)
+        if self.synt_analysis:
+            message_synt, tokens, synt_spans = self._stage("format_synt", format_synt, doc)
+            synt_tree = self._stage("draw_synt_tree", draw_synt_tree, tokens, synt_spans)
+
+        result = message_lemmas, message_morph, message_synt, synt_tree
+        if self.cache is not None:
+            self.cache.set(key, result)
+        return result
@@ -0,0 +1,125 @@
+"""What the bot remembers about its answers, so that their buttons act on the right book.
+
+A session belongs to the message a command was sent with: it is kept by (chat id, message id),
+and the message id goes into the callback data of the answer's buttons. It holds the litra work
+the answer is about and the task fetching the work's short version, which keeps the result once done.
+"""
+
+import sys
+import time
+import asyncio
+from collections import OrderedDict
+
+from setup import SESSION_TTL, SESSION_MAX_COUNT, SESSION_MAX_BYTES
+
+
+class Session:
+    def __init__(self, key, work):
+        self.key = key
+        # corpus.Work
+        self.work = work
+        # asyncio task returning the author, title and text of the short version
+        self.shortwork = None
+
+    def fetching_shortwork(self):
+        """Whether the short version is fetched or being fetched, False if its fetch failed."""
+        if self.shortwork is None or self.shortwork.cancelled():
+            return False
+        return not self.shortwork.done() or self.shortwork.exception() is None
+
+    def size(self):
+        """Bytes taken by the texts of the session."""
+        size = sys.getsizeof(self.work.text)
+        if self.fetching_shortwork() and self.shortwork.done():
+            size += sys.getsizeof(self.shortwork.result()[2])
+        return size
+
+
+class SessionStore:
+    """Sessions by chat and message id, for the coroutines of the bot's event loop (not thread-safe).
+
+    Sessions older than ttl seconds are treated as missing, and the least recently used ones are dropped
+    once there are more than maxsize of them or their texts take more than max_bytes.
+    Dropping a session cancels its fetch if it's still running.
+    """
+
+    def __init__(self, maxsize=SESSION_MAX_COUNT, max_bytes=SESSION_MAX_BYTES, ttl=SESSION_TTL):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> [session, size, expires_at]
+        self._sessions = OrderedDict()
+        self._size = 0
+        # the running fetches, the loop only keeps weak references to the tasks
+        self._tasks = set()
+
+    def get(self, chat_id: int, message_id: int):
+        """Return the session of the message, None if there's none or it expired."""
+        key = (chat_id, message_id)
+        item = self._sessions.get(key)
+        if item is None:
+            return None
+        if item[2] < time.monotonic():
+            self.discard(chat_id, message_id)
+            return None
+        self._sessions.move_to_end(key)
+        return item[0]
+
+    def start(self, chat_id: int, message_id: int, work):
+        """Create the session of the message with the work, replacing the previous one."""
+        self.discard(chat_id, message_id)
+        now = time.monotonic()
+        for key in [key for key, (_, _, expires_at) in self._sessions.items() if expires_at < now]:
+            self.discard(*key)
+        session = Session((chat_id, message_id), work)
+        self._sessions[session.key] = [session, session.size(), now + self.ttl]
+        self._size += self._sessions[session.key][1]
+        self._shrink()
+        return session
+
+    def fetch_shortwork(self, session: Session, coroutine):
+        """Run the coroutine fetching the short version of the session's work in the background."""
+        if session.shortwork is not None:
+            session.shortwork.cancel()
+        session.shortwork = asyncio.ensure_future(coroutine)
+        self._tasks.add(session.shortwork)
+        session.shortwork.add_done_callback(lambda task: self._fetched(session, task))
+        return session.shortwork
+
+    def _fetched(self, session: Session, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        # the exception is raised again for whoever awaits the task, nobody may
+        task.exception()
+        item = self._sessions.get(session.key)
+        if item is not None and item[0] is session:
+            size = session.size()
+            self._size += size - item[1]
+            item[1] = size
+            self._shrink()
+
+    def _shrink(self):
+        while self._sessions and (len(self._sessions) > self.maxsize or self._size > self.max_bytes):
+            self.discard(*next(iter(self._sessions)))
+
+    def discard(self, chat_id: int, message_id: int):
+        item = self._sessions.pop((chat_id, message_id), None)
+        if item is None:
+            return
+        session, size, _ = item
+        self._size -= size
+        if session.shortwork is not None:
+            session.shortwork.cancel()
+
+    def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._sessions.clear()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+SESSIONS = SessionStore()
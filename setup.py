@@ -1,10 +1,79 @@
 # -*- coding: utf-8 -*-
-from decouple import config
+import os
+
+from decouple import Csv, config
 
 
 TOKEN = config("TOKEN", default="TOKEN")
 PROXY = config("PROXY", default="PROXY")
 
-# for htmlcsstoimage
-HCTI_API_USER_ID = config("HCTI_API_USER_ID", default="HCTI_API_USER_ID")
-HCTI_API_KEY = config("HCTI_API_KEY", default="HCTI_API_KEY")
+# font for the syntax tree images, it has to support Cyrillic
+SYNTAX_TREE_FONT = config("SYNTAX_TREE_FONT", default="DejaVuSans.ttf")
+
+# spellcheck vocabulary
+VOCAB_CORPUS_PATH = config("VOCAB_CORPUS_PATH", default="lifenews2.txt")
+VOCAB_PATH = config("VOCAB_PATH", default="lifenews2.vocab.gz")
+CORRECTIONS_CACHE_SIZE = config("CORRECTIONS_CACHE_SIZE", default=10000, cast=int)
+# "counter" keeps the vocabulary in a dict, "trie" memory-maps a compact trie shared by the processes
+VOCAB_BACKEND = config("VOCAB_BACKEND", default="counter")
+VOCAB_TRIE_PATH = config("VOCAB_TRIE_PATH", default="lifenews2.vocab.trie")
+# rank spellcheck corrections with the n-gram model (see language_model.py)
+NGRAM_RANKING = config("NGRAM_RANKING", default=False, cast=bool)
+NGRAM_MODEL_PATH = config("NGRAM_MODEL_PATH", default="lifenews2.ngrams")
+
+# /sentence results cache
+ANALYSIS_CACHE_DIR = config("ANALYSIS_CACHE_DIR", default="cache/analyses")
+ANALYSIS_CACHE_SIZE = config("ANALYSIS_CACHE_SIZE", default=256, cast=int)
+ANALYSIS_CACHE_MAX_BYTES = config("ANALYSIS_CACHE_MAX_BYTES", default=200 * 2 ** 20, cast=int)
+ANALYSIS_CACHE_TTL = config("ANALYSIS_CACHE_TTL", default=30 * 24 * 60 * 60, cast=int)
+
+# updates handled at once by the bot's event loop, and the threads of its executor for the blocking calls
+# (file and database IO, Wiktionary, waiting on the summaries)
+CONCURRENT_UPDATES = config("CONCURRENT_UPDATES", default=256, cast=int)
+BLOCKING_WORKERS = config("BLOCKING_WORKERS", default=16, cast=int)
+# worker processes for the NLP jobs
+NLP_WORKERS = config("NLP_WORKERS", default=os.cpu_count() or 2, cast=int)
+SUMMARY_TIMEOUT = config("SUMMARY_TIMEOUT", default=90, cast=int)
+SUMMARY_WORKERS = config("SUMMARY_WORKERS", default=2, cast=int)
+# processes summarizing the pages of a long text in parallel, kept by every summarization worker,
+# so the cores are shared between the summarization workers by default
+CHUNK_WORKERS = config("CHUNK_WORKERS", default=max((os.cpu_count() or 2) // SUMMARY_WORKERS, 1), cast=int)
+# parsed documents and page summaries kept by every summarization worker, and parsed pages by its page processes
+DOCUMENT_CACHE_SIZE = config("DOCUMENT_CACHE_SIZE", default=8, cast=int)
+DOCUMENT_CACHE_MAX_BYTES = config("DOCUMENT_CACHE_MAX_BYTES", default=256 * 2 ** 20, cast=int)
+# finished /summary results
+SUMMARY_CACHE_DIR = config("SUMMARY_CACHE_DIR", default="cache/summaries")
+SUMMARY_CACHE_SIZE = config("SUMMARY_CACHE_SIZE", default=64, cast=int)
+SUMMARY_CACHE_MAX_BYTES = config("SUMMARY_CACHE_MAX_BYTES", default=100 * 2 ** 20, cast=int)
+SUMMARY_CACHE_TTL = config("SUMMARY_CACHE_TTL", default=7 * 24 * 60 * 60, cast=int)
+# scraper HTTP requests: seconds per request including retries, seconds to connect, attempts after the first one,
+# seconds before the first retry (doubled for the next ones), simultaneous requests per host
+HTTP_TIMEOUT = config("HTTP_TIMEOUT", default=20, cast=float)
+HTTP_CONNECT_TIMEOUT = config("HTTP_CONNECT_TIMEOUT", default=5, cast=float)
+HTTP_RETRIES = config("HTTP_RETRIES", default=2, cast=int)
+HTTP_BACKOFF = config("HTTP_BACKOFF", default=0.5, cast=float)
+HTTP_HOST_CONCURRENCY = config("HTTP_HOST_CONCURRENCY", default=4, cast=int)
+# scraped pages kept on disk, the TTL is for the pages that can't be revalidated with ETag/Last-Modified
+HTTP_CACHE_DIR = config("HTTP_CACHE_DIR", default="cache/http")
+HTTP_CACHE_MAX_BYTES = config("HTTP_CACHE_MAX_BYTES", default=500 * 2 ** 20, cast=int)
+HTTP_CACHE_TTL = config("HTTP_CACHE_TTL", default=7 * 24 * 60 * 60, cast=int)
+# only plain GETs are cached, the Wikipedia API calls have params and are cached by MediaWikiClient instead
+HTTP_CACHE_HOSTS = config("HTTP_CACHE_HOSTS", default="litra.ru", cast=Csv())
+# the litra works of the bot's answers by chat and message, for their buttons, with the short versions
+# fetched while /summary runs in case it times out
+SESSION_TTL = config("SESSION_TTL", default=60 * 60, cast=int)
+SESSION_MAX_COUNT = config("SESSION_MAX_COUNT", default=1024, cast=int)
+SESSION_MAX_BYTES = config("SESSION_MAX_BYTES", default=256 * 2 ** 20, cast=int)
+# MediaWiki API for /wikipedia and the Wikipedia summaries, titles and texts are cached for the TTL
+WIKIPEDIA_API_URL = config("WIKIPEDIA_API_URL", default="https://ru.wikipedia.org/w/api.php")
+WIKIPEDIA_USER_AGENT = config("WIKIPEDIA_USER_AGENT", default="SchoolmonsterBot/1.0 (Telegram bot)")
+WIKIPEDIA_CACHE_SIZE = config("WIKIPEDIA_CACHE_SIZE", default=256, cast=int)
+WIKIPEDIA_CACHE_TTL = config("WIKIPEDIA_CACHE_TTL", default=24 * 60 * 60, cast=int)
+# the library of the litra.ru works /litra and /summary find by title
+CORPUS_PATH = config("CORPUS_PATH", default="corpus.sqlite3")
+# /relwords index, see `python relwords.py import`; words with nothing found are looked up again after the TTL
+RELWORDS_INDEX_PATH = config("RELWORDS_INDEX_PATH", default="relwords.sqlite3")
+RELWORDS_CACHE_SIZE = config("RELWORDS_CACHE_SIZE", default=4096, cast=int)
+RELWORDS_NEGATIVE_TTL = config("RELWORDS_NEGATIVE_TTL", default=7 * 24 * 60 * 60, cast=int)
+# measured running times of the summarization algorithms, see `python summarization.py calibrate`
+SUMMARY_COST_MODEL_PATH = config("SUMMARY_COST_MODEL_PATH", default="summary_costs.json")
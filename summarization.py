@@ -1,38 +1,464 @@
-import random
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import scipy.sparse as sp
 
 import sumy
 from sumy.parsers.plaintext import PlaintextParser
+from sumy.models.dom import ObjectDocumentModel, Paragraph
 from sumy.nlp.tokenizers import Tokenizer
+from sumy.summarizers._summarizer import AbstractSummarizer
 from sumy.summarizers.luhn import LuhnSummarizer
 from sumy.summarizers.lsa import LsaSummarizer
-from sumy.summarizers.text_rank import TextRankSummarizer
-from sumy.summarizers.lex_rank import LexRankSummarizer
 from sumy.summarizers.kl import KLSummarizer
 from sumy.nlp.stemmers import Stemmer
 from sumy.utils import get_stop_words
 
 import nltk
 
+from caching import DiskCache, LRUCache, TieredCache
+from setup import (CHUNK_WORKERS, DOCUMENT_CACHE_SIZE, DOCUMENT_CACHE_MAX_BYTES, SUMMARY_COST_MODEL_PATH,
+                   SUMMARY_WORKERS, VOCAB_CORPUS_PATH, SUMMARY_CACHE_DIR, SUMMARY_CACHE_SIZE, SUMMARY_CACHE_MAX_BYTES,
+                   SUMMARY_CACHE_TTL)
+
+logger = logging.getLogger(__name__)
+
+# Every chunk summary is this many times longer than the chunk's share of the final summary,
+# so that the final pass has sentences to choose from
+CHUNK_OVERSAMPLING = 2
+# The page processes are forked where possible, so that they inherit the loaded tokenizer, stemmer and stop words
+# and are killed with the process group of the summarization worker when it misses its deadline
+CHUNK_CONTEXT = multiprocessing.get_context(
+    "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+# The cores a summarization worker can count on while the others are busy too
+CHUNK_CORES = max((os.cpu_count() or 1) // SUMMARY_WORKERS, 1)
+STEM_CACHE_SIZE = 200000
+
+# Parsed and tokenized documents by (source, language, text length), see get_document(),
+# and the page summaries of the long texts, see chunked_summarization();
+# the page processes keep the pages they parsed with (source, page index) for the source
+DOCUMENTS = LRUCache(maxsize=DOCUMENT_CACHE_SIZE, max_bytes=DOCUMENT_CACHE_MAX_BYTES,
+                     sizeof=lambda value: document_bytes(value))
+# The page processes of this summarization worker, started by its first long text and kept for the next ones
+_CHUNK_POOLS = []
+# Finished summaries with the names of their algorithms and the authors and titles of the texts, see summary_key()
+SUMMARY_CACHE = TieredCache(LRUCache(maxsize=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL),
+                            DiskCache(SUMMARY_CACHE_DIR, max_bytes=SUMMARY_CACHE_MAX_BYTES, ttl=SUMMARY_CACHE_TTL))
+
+
+def row_normalize(matrix):
+    row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+    return sp.diags(np.divide(1, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)) @ matrix
+
+
+class SparseRankSummarizer(AbstractSummarizer):
+    """Graph-based summarizer working on a sparse TF-IDF matrix of the sentences.
+
+    Sentence similarities are cosine similarities computed by a sparse matrix product in blocks of rows.
+    In documents longer than sparsify_from sentences only the top_k most similar neighbours
+    of every sentence are kept, so the graph stays sparse. Sentences are ranked by power iteration.
+    """
+
+    damping = 0.85
+    epsilon = 1e-4
+    max_iterations = 100
+    top_k = 30
+    sparsify_from = 1000
+    block_size = 512
+
+    _stop_words = frozenset()
+
+    @property
+    def stop_words(self):
+        return self._stop_words
+
+    @stop_words.setter
+    def stop_words(self, words):
+        self._stop_words = frozenset(map(self.normalize_word, words))
+
+    def __call__(self, document, sentences_count):
+        sentences = document.sentences
+        if not sentences:
+            return ()
+        scores = self.rank(self.similarity(self.tfidf(sentences)))
+        ratings = dict(zip(sentences, scores))
+        return self._get_best_sentences(sentences, sentences_count, ratings)
+
+    def tfidf(self, sentences):
+        """Return the L2-normalized TF-IDF matrix of the sentences over the stems of their words."""
+        # word -> stem column, None for stop words; stemming is slow, so every word is stemmed once
+        word_columns, stems, rows, columns = {}, {}, [], []
+        for row, sentence in enumerate(sentences):
+            for word in sentence.words:
+                if word not in word_columns:
+                    word_columns[word] = (None if self.normalize_word(word) in self._stop_words
+                                          else stems.setdefault(self.stem_word(word), len(stems)))
+                if word_columns[word] is not None:
+                    rows.append(row)
+                    columns.append(word_columns[word])
+        # duplicate (row, column) pairs are summed up into term frequencies
+        counts = sp.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(sentences), len(stems)))
+        document_frequency = np.bincount(counts.indices, minlength=len(stems))
+        idf = np.log(len(sentences) / np.maximum(document_frequency, 1))
+        matrix = sp.csr_matrix(counts.multiply(idf))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        return sp.diags(np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)) @ matrix
+
+    def similarity(self, matrix):
+        """Return the sparse sentence similarity matrix without self-similarities."""
+        sparsify = matrix.shape[0] >= self.sparsify_from
+        transposed = matrix.T.tocsc()
+        blocks = []
+        for start in range(0, matrix.shape[0], self.block_size):
+            block = matrix[start:start + self.block_size] @ transposed
+            diagonal = np.arange(block.shape[0])
+            block = sp.csr_matrix(block - sp.csr_matrix((block.diagonal(k=start), (diagonal, diagonal + start)),
+                                                        shape=block.shape))
+            if sparsify:
+                block = self._top_k(block)
+            blocks.append(block)
+        similarity = sp.vstack(blocks).tocsr()
+        if sparsify:
+            similarity = similarity.maximum(similarity.T)
+        similarity.eliminate_zeros()
+        return similarity
+
+    def _top_k(self, block):
+        """Keep the top_k largest values of every row of the CSR block."""
+        data = block.data
+        for row in range(block.shape[0]):
+            start, end = block.indptr[row], block.indptr[row + 1]
+            if end - start > self.top_k:
+                row_data = data[start:end]
+                row_data[np.argpartition(row_data, -self.top_k)[:-self.top_k]] = 0
+        block.eliminate_zeros()
+        return block
+
+    def transitions(self, similarity):
+        """Return the row-stochastic transition matrix of the sentence graph, TextRank's by default."""
+        return row_normalize(similarity)
+
+    def rank(self, similarity):
+        """Return the PageRank score of every sentence."""
+        transitions = self.transitions(similarity)
+        sentences_count = transitions.shape[0]
+        incoming = transitions.T.tocsr()
+        dangling = np.asarray(transitions.sum(axis=1)).ravel() == 0
+        scores = np.full(sentences_count, 1 / sentences_count)
+        for _ in range(self.max_iterations):
+            new_scores = ((1 - self.damping) / sentences_count
+                          + self.damping * (incoming @ scores + scores[dangling].sum() / sentences_count))
+            converged = np.abs(new_scores - scores).sum() < self.epsilon
+            scores = new_scores
+            if converged:
+                break
+        return scores
+
+
+class TextRankSummarizer(SparseRankSummarizer):
+    """TextRank: the sentences vote for each other in proportion to their similarity."""
+
+
+class LexRankSummarizer(SparseRankSummarizer):
+    """LexRank: the sentences vote equally for every sentence more similar to them than the threshold."""
+
+    threshold = 0.1
+
+    def transitions(self, similarity):
+        adjacency = (similarity >= self.threshold).astype(np.float64)
+        return row_normalize(adjacency)
+
+
 ALGORITHMS = {"luhn": LuhnSummarizer,
               "lsa": LsaSummarizer,
               "tr": TextRankSummarizer,
               "lr": LexRankSummarizer,
               "kl": KLSummarizer}
 
+# From the best summaries to the worst, the first algorithm expected to finish in time is chosen
+ALGORITHM_PREFERENCE = ("lsa", "lr", "tr", "luhn", "kl")
+# Only this share of the remaining time is planned for, the rest covers estimate errors and sending the reply
+COST_SAFETY_MARGIN = 0.5
+# seconds = scale * (sentences * vocabulary) ** power, measured with `python summarization.py calibrate`
+# on 50-3000 sentences; KL is only fast enough for short texts
+DEFAULT_COST_CURVES = {"luhn": (7.0e-5, 0.59),
+                       "lsa": (3.5e-7, 1.10),
+                       "tr": (1.2e-5, 0.58),
+                       "lr": (8.8e-6, 0.61),
+                       "kl": (3.4e-8, 1.56)}
+
+
+class CostModel:
+    """Estimates how long the algorithms take on a document from its numbers of sentences and distinct words."""
+
+    def __init__(self, curves=None):
+        self.curves = {**DEFAULT_COST_CURVES, **(curves or {})}
+
+    @classmethod
+    def load(cls, path=SUMMARY_COST_MODEL_PATH):
+        """Load the measured cost curves, the defaults are used for the algorithms missing from the file."""
+        try:
+            with open(path, encoding="utf-8") as file:
+                return cls({algorithm: tuple(curve) for algorithm, curve in json.load(file).items()})
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path=SUMMARY_COST_MODEL_PATH):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.curves, file, indent=1)
+
+    @classmethod
+    def fit(cls, measurements):
+        """Fit the cost curves to {algorithm: [(sentences, vocabulary, seconds), ...]} in log-log space."""
+        curves = {}
+        for algorithm, points in measurements.items():
+            sizes = np.log([sentences * vocabulary for sentences, vocabulary, _ in points])
+            seconds = np.log([max(seconds, 1e-6) for _, _, seconds in points])
+            power, log_scale = np.polyfit(sizes, seconds, 1)
+            curves[algorithm] = (float(np.exp(log_scale)), float(power))
+        return cls(curves)
+
+    def estimate(self, algorithm: str, sentences: int, vocabulary: int):
+        scale, power = self.curves[algorithm]
+        return scale * max(sentences * vocabulary, 1) ** power
+
+    def choose(self, sentences: int, vocabulary: int, budget: float, preference=ALGORITHM_PREFERENCE):
+        """Return the most preferred algorithm expected to finish within budget seconds, else the fastest one."""
+        for algorithm in preference:
+            if self.estimate(algorithm, sentences, vocabulary) <= budget * COST_SAFETY_MARGIN:
+                return algorithm
+        return min(preference, key=lambda algorithm: self.estimate(algorithm, sentences, vocabulary))
+
+
+@functools.lru_cache(maxsize=None)
+def get_cost_model():
+    return CostModel.load()
+
+
+def document_size(document):
+    """Return the numbers of sentences and distinct words of the parsed document."""
+    sentences = document.sentences
+    vocabulary = {word.lower() for sentence in sentences for word in sentence.words}
+    return len(sentences), len(vocabulary)
+
+
+def document_bytes(document):
+    """Estimate the bytes taken by a DOCUMENTS value, a parsed document or a list of page summaries."""
+    if isinstance(document, list):
+        return sum(map(sys.getsizeof, document))
+    # the sentence objects and their word tuples take about 200 bytes more
+    return sum(sys.getsizeof(sentence._text) + sum(map(sys.getsizeof, sentence.words)) + 200
+               for sentence in document.sentences)
+
 
-def summarization(text: str, n_sents: int, language="russian", algorithm=None):
-    parser = PlaintextParser.from_string(text, Tokenizer(language))
-    stemmer = Stemmer(language)
-    if not algorithm or algorithm not in ALGORITHMS:
-        algorithm = random.choice(list(ALGORITHMS.items()))[1]
-    else:
-        algorithm = ALGORITHMS[algorithm]
-    summarizer = algorithm(stemmer)
-    summarizer.stop_words = nltk.corpus.stopwords.words("russian")
-    result = "\n".join(str(sentence) for sentence in summarizer(parser.document, n_sents))
-    algorithm = algorithm.__name__.removesuffix("Summarizer")
-    return result, algorithm
+def choose_algorithm(sentences: int, vocabulary: int, algorithm=None, deadline=None, rounds=1):
+    """Return the name of the algorithm to summarize a document of this size with before the deadline.
+
+    A known requested algorithm is kept unless it is expected to miss the deadline (a time.time() value).
+    rounds is how many documents of this size have to be summarized one after another.
+    """
+    budget = math.inf if deadline is None else (deadline - time.time()) / rounds
+    model = get_cost_model()
+    if algorithm in ALGORITHMS:
+        if model.estimate(algorithm, sentences, vocabulary) <= budget * COST_SAFETY_MARGIN:
+            return algorithm
+        fallback = model.choose(sentences, vocabulary, budget)
+        logger.info(f"{algorithm} would take too long for {sentences} sentences and {vocabulary} words, "
+                    f"using {fallback}")
+        return fallback
+    return model.choose(sentences, vocabulary, budget)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(language: str):
+    return Tokenizer(language)
+
+
+@functools.lru_cache(maxsize=None)
+def get_stemmer(language: str):
+    """Return the stemmer of the language, it remembers the stems of the words it has seen."""
+    return functools.lru_cache(maxsize=STEM_CACHE_SIZE)(Stemmer(language))
+
+
+@functools.lru_cache(maxsize=None)
+def load_stop_words(language: str):
+    return tuple(nltk.corpus.stopwords.words(language))
+
+
+def preload(language="russian"):
+    """Load the tokenizer, stemmer and stop-word resources ahead of the first summary."""
+    get_tokenizer(language)
+    get_stemmer(language)
+    load_stop_words(language)
+
+
+def parse(text: str, language="russian"):
+    """Split the text into sentences and words."""
+    document = PlaintextParser.from_string(text, get_tokenizer(language)).document
+    # sentences remember their words once they are split
+    for sentence in document.sentences:
+        sentence.words
+    return document
+
+
+def get_document(text: str, language="russian", source=None):
+    """Return the parsed text, reusing the document parsed before for the same source (a URL or a title)."""
+    if source is None:
+        return parse(text, language)
+    key = (source, language, len(text))
+    document = DOCUMENTS.get(key)
+    if document is None:
+        document = parse(text, language)
+        DOCUMENTS.set(key, document)
+    return document
+
+
+def summarize_document(document, n_sents: int, language="russian", algorithm=None, deadline=None, rounds=1):
+    """Summarize the parsed document, choosing the algorithm if it isn't given or doesn't fit before the deadline.
+
+    Returns the summary, the name of the algorithm used and its ALGORITHMS key.
+    rounds is how many documents of this size have to be summarized one after another before the deadline.
+    """
+    algorithm = choose_algorithm(*document_size(document), algorithm, deadline, rounds)
+    summarizer = ALGORITHMS[algorithm](get_stemmer(language))
+    summarizer.stop_words = load_stop_words(language)
+    result = "\n".join(str(sentence) for sentence in summarizer(document, n_sents))
+    return result, ALGORITHMS[algorithm].__name__.removesuffix("Summarizer"), algorithm
+
+
+def summarization(text: str, n_sents: int, language="russian", algorithm=None, source=None, deadline=None):
+    return summarize_document(get_document(text, language, source), n_sents, language, algorithm, deadline)
     # TODO: customisable num_sents
     # TODO: smart num_sents for wiki
-    # TODO: use the simplest summarization methods instead of random
 
+
+def summary_key(source: str, algorithm=None, n_sents=None):
+    """Return the SUMMARY_CACHE key of the summary of the source (a URL or a title).
+
+    An unknown algorithm stands for the automatic choice, and n_sents=None for the default length of the source.
+    """
+    return source, algorithm if algorithm in ALGORITHMS else None, n_sents
+
+
+def split_chunks(text: str, chunks_count: int):
+    """Split the text at line breaks into up to chunks_count chunks of about the same length."""
+    lines = text.splitlines(keepends=True)
+    chunk_length = len(text) / max(chunks_count, 1)
+    chunks, chunk, length = [], [], 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= chunk_length * (len(chunks) + 1) and len(chunks) < chunks_count - 1:
+            chunks.append("".join(chunk))
+            chunk = []
+    if chunk:
+        chunks.append("".join(chunk))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def get_chunk_pools():
+    """Return the CHUNK_WORKERS page processes of this process, starting them on the first call.
+
+    Every page process is a pool of its own, so that the same page of a text always goes to the same process.
+    """
+    if not _CHUNK_POOLS:
+        # the forked processes start without the documents of this one
+        _CHUNK_POOLS.extend(ProcessPoolExecutor(max_workers=1, mp_context=CHUNK_CONTEXT, initializer=DOCUMENTS.clear)
+                            for _ in range(CHUNK_WORKERS))
+    return _CHUNK_POOLS
+
+
+def chunk_rounds(chunks_count: int, workers=CHUNK_WORKERS, cores=CHUNK_CORES):
+    """Return how many pages of a text are summarized one after another by a summarization worker.
+
+    Only as many pages are summarized at once as there are page processes and cores for them.
+    """
+    return math.ceil(chunks_count / max(min(workers, cores, chunks_count), 1))
+
+
+def _summarize_chunk(chunk: str, n_sents: int, language: str, algorithm: str, deadline, rounds: int, source):
+    return summarize_document(get_document(chunk, language, source), n_sents, language, algorithm, deadline, rounds)
+
+
+def chunked_summarization(text: str, n_sents: int, num_pages: int, language="russian", algorithm=None,
+                          source=None, deadline=None):
+    """Summarize every page of the text in the page processes, then summarize the page summaries.
+
+    Every process parses and holds only its own pages and chooses the algorithm for them,
+    and the final pass only holds the page summaries.
+    With a source, the page processes keep the parsed pages for the next summaries of the same text
+    with any algorithm, and the page summaries are kept in DOCUMENTS for the same algorithm.
+    """
+    chunks = split_chunks(text, num_pages)
+    if len(chunks) <= 1:
+        return summarization(text, n_sents, language, algorithm, source, deadline)
+    chunk_sents = math.ceil(n_sents * CHUNK_OVERSAMPLING / len(chunks))
+
+    key = (source, language, len(text), len(chunks), algorithm, chunk_sents)
+    summaries = DOCUMENTS.get(key) if source is not None else None
+    if summaries is None:
+        pools = get_chunk_pools()
+        rounds = chunk_rounds(len(chunks))
+        try:
+            futures = [pools[index % len(pools)].submit(
+                _summarize_chunk, chunk, chunk_sents, language, algorithm, deadline, rounds,
+                None if source is None else (source, index)) for index, chunk in enumerate(chunks)]
+            summaries = [future.result()[0] for future in futures]
+        except BrokenProcessPool:
+            # a page process died, the next long text starts new ones
+            for pool in _CHUNK_POOLS:
+                pool.shutdown(wait=False, cancel_futures=True)
+            _CHUNK_POOLS.clear()
+            raise
+        if source is not None:
+            DOCUMENTS.set(key, summaries)
+    # the final pass only switches from the requested algorithm to a faster one if it is late
+    return summarization("\n".join(summaries), n_sents, language, algorithm, deadline=deadline)
+
+
+def calibrate(corpus: str, sizes=(100, 300, 1000, 3000), n_sents=10, language="russian"):
+    """Time every algorithm on the first sentences of the corpus and fit the cost curves."""
+    with open(corpus, encoding="utf-8") as file:
+        text = file.read(200 * max(sizes))
+    sentences = parse(text, language).sentences
+    measurements = {algorithm: [] for algorithm in ALGORITHMS}
+    for size in sizes:
+        document = ObjectDocumentModel([Paragraph(sentences[:size])])
+        for algorithm in ALGORITHMS:
+            start = time.perf_counter()
+            summarize_document(document, n_sents, language, algorithm)
+            measurements[algorithm].append((*document_size(document), time.perf_counter() - start))
+    return CostModel.fit(measurements)
+
+
+def main():
+    """Measure how long the summarization algorithms take on this machine."""
+    arg_parser = argparse.ArgumentParser(description="Summarization tools")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    calibrate_parser = subparsers.add_parser("calibrate", help="measure the cost curves of the algorithms")
+    calibrate_parser.add_argument("--corpus", default=VOCAB_CORPUS_PATH)
+    calibrate_parser.add_argument("--output", default=SUMMARY_COST_MODEL_PATH)
+    calibrate_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 300, 1000, 3000],
+                                  help="numbers of sentences to time the algorithms on")
+    args = arg_parser.parse_args()
+
+    if args.command == "calibrate":
+        model = calibrate(args.corpus, args.sizes)
+        model.save(args.output)
+        for algorithm, (scale, power) in model.curves.items():
+            print(f"{algorithm}: {scale:.3g} * (sentences * vocabulary) ** {power:.2f} s")
+        print(f"Saved the cost curves to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Draws dependency trees of sentences as PNG images."""
+
+import logging
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+from setup import SYNTAX_TREE_FONT
+
+logger = logging.getLogger(__name__)
+
+# Layout, in pixels
+TOKEN_FONT_SIZE = 22
+LABEL_FONT_SIZE = 15
+PADDING = 20
+TOKEN_GAP = 28
+LEVEL_HEIGHT = 34
+ARROW_SIZE = 6
+
+# Telegram rejects photos with a side more than 20 times longer than the other one
+MAX_ASPECT_RATIO = 20
+
+TEXT_COLOR = "#222222"
+ARC_COLOR = "#3c6eb4"
+LABEL_COLOR = "#b43c3c"
+BACKGROUND_COLOR = "white"
+
+
+def load_font(size: int):
+    """Load the configured TrueType font, falling back to Pillow's default one."""
+    try:
+        return ImageFont.truetype(SYNTAX_TREE_FONT, size)
+    except OSError:
+        logger.warning(f"Can't load font {SYNTAX_TREE_FONT}, Cyrillic text may not be drawn")
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:
+            return ImageFont.load_default()
+
+
+def arc_levels(arcs: list):
+    """Return the height level of every (start, end) arc so that an arc is drawn above all arcs inside it."""
+    levels = {}
+    for index in sorted(range(len(arcs)), key=lambda index: arcs[index][1] - arcs[index][0]):
+        start, end = arcs[index]
+        inner = [levels[other] for other in levels
+                 if start <= arcs[other][0] and arcs[other][1] <= end and arcs[other] != arcs[index]]
+        levels[index] = max(inner, default=0) + 1
+    return [levels[index] for index in range(len(arcs))]
+
+
+def render_synt_tree(tokens: list, synt_spans: list):
+    """Draw the (head, dependent, relation) arcs over the tokens and return the PNG image bytes.
+
+    The root is marked by a head of -1.
+    """
+    token_font = load_font(TOKEN_FONT_SIZE)
+    label_font = load_font(LABEL_FONT_SIZE)
+    measure = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+    # Place the tokens in a row
+    widths = [max(measure.textlength(token, font=token_font), 1) for token in tokens]
+    centers, x = [], PADDING
+    for width in widths:
+        centers.append(x + width / 2)
+        x += width + TOKEN_GAP
+    image_width = int(x - TOKEN_GAP + PADDING)
+
+    arcs = [(min(head, dependent), max(head, dependent)) for head, dependent, _ in synt_spans if head != -1]
+    levels = arc_levels(arcs)
+    top_level = max(levels, default=0) + 1
+    token_top = PADDING + top_level * LEVEL_HEIGHT
+    image_height = token_top + TOKEN_FONT_SIZE + 2 * PADDING
+    image_height = max(image_height, image_width // MAX_ASPECT_RATIO + 1)
+    image_width = max(image_width, image_height // MAX_ASPECT_RATIO + 1)
+
+    image = Image.new("RGB", (image_width, image_height), BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(image)
+
+    for center, token in zip(centers, tokens):
+        draw.text((center, token_top + PADDING // 2), token, fill=TEXT_COLOR, font=token_font, anchor="mt")
+
+    arc_bottom = token_top + PADDING // 4
+    labels = []
+    arcs_iter = iter(levels)
+    for head, dependent, relation in synt_spans:
+        dependent_x = centers[dependent]
+        if head == -1:
+            arc_top = PADDING
+            draw.line([(dependent_x, arc_top), (dependent_x, arc_bottom)], fill=ARC_COLOR, width=2)
+            label_x = dependent_x
+        else:
+            level = next(arcs_iter)
+            left, right = sorted((centers[head], dependent_x))
+            arc_top = arc_bottom - level * LEVEL_HEIGHT
+            draw.arc([(left, arc_top), (right, 2 * arc_bottom - arc_top)], 180, 360, fill=ARC_COLOR, width=2)
+            label_x = (left + right) / 2
+        draw.polygon([(dependent_x - ARROW_SIZE, arc_bottom - ARROW_SIZE * 2),
+                      (dependent_x + ARROW_SIZE, arc_bottom - ARROW_SIZE * 2),
+                      (dependent_x, arc_bottom)], fill=ARC_COLOR)
+        labels.append((label_x, arc_top, relation))
+
+    # Labels go last so that no arc crosses them
+    for label_x, arc_top, relation in labels:
+        box = draw.textbbox((label_x, arc_top), relation, font=label_font, anchor="mm")
+        draw.rectangle([box[0] - 2, box[1] - 1, box[2] + 2, box[3] + 1], fill=BACKGROUND_COLOR)
+        draw.text((label_x, arc_top), relation, fill=LABEL_COLOR, font=label_font, anchor="mm")
+
+    output = BytesIO()
+    image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
@@ -0,0 +1,31 @@
+import check_dic
+from check_dic import SymSpellIndex, TrieVocabulary, check_word, correct_many
+
+COUNTS = {"я": 50, "а": 40, "и": 60, "в": 70, "он": 30, "мы": 20, "кот": 10, "пришёл": 5, "домой": 8}
+
+
+def test_punctuation_is_not_corrected(monkeypatch):
+    trie = TrieVocabulary.from_counts(COUNTS)
+    monkeypatch.setattr(check_dic, "get_vocab", lambda: trie)
+    monkeypatch.setattr(check_dic, "get_index", lambda: trie)
+    monkeypatch.setattr(check_dic, "CORRECTIONS_CACHE", check_dic.LRUCache())
+    tokens = ["кот", ",", "пришол", "домой", "."]
+    assert correct_many(tokens, context_ranking=False) == [("кот", True), (",", True), ("пришёл", False),
+                                                           ("домой", True), (".", True)]
+    for index in (trie, SymSpellIndex(COUNTS)):
+        assert check_word("«", COUNTS, index) == (True, ())
+
+
+def brute_force(in_word, count_dict, max_distance=check_dic.MAX_EDIT_DISTANCE):
+    candidates = [(word, check_dic.edit_distance(in_word, word, max_distance), count)
+                  for word, count in count_dict.items()]
+    candidates = [candidate for candidate in candidates if candidate[1] <= max_distance]
+    return sorted(candidates, key=lambda candidate: (candidate[1], -candidate[2], candidate[0]))
+
+
+def test_short_typos_match_brute_force():
+    index = SymSpellIndex(COUNTS)
+    # a substitution in a 1-letter word, and 2-letter queries 2 edits away from 1-letter words
+    for in_word in ["ы", "он", "ом", "ты", "кт", "б"]:
+        assert index.lookup(in_word) == brute_force(in_word, COUNTS)
+    assert ("я", 1, 50) in index.lookup("ы")
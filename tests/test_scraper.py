@@ -0,0 +1,15 @@
+from pathlib import Path
+
+from scraper import parse_text_page
+from scraper_benchmark import parse_text_page_bs4
+
+PAGES = Path(__file__).parent / "pages"
+
+
+def test_text_page_keeps_lines_around_links():
+    page = (PAGES / "text_page.html").read_text(encoding="utf-8")
+    title, text = parse_text_page(page)
+    assert title == "Автор - Произведение"
+    assert text == ("\nПервая строка \n хвост строки.\nВторая строка со \n, и дальше.\nПоследняя строка.\n"
+                    "\nCreated by Litra.RU Team\n")
+    assert (title, text) == parse_text_page_bs4(page)
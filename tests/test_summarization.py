@@ -0,0 +1,48 @@
+import re
+import time
+
+from sumy.models.dom import ObjectDocumentModel, Paragraph, Sentence
+
+import summarization
+from summarization import CostModel, choose_algorithm, chunk_rounds, summarize_document
+
+SENTENCES = ["Кот пришёл домой поздно вечером.", "Дома кота ждала миска молока.",
+             "Собака спала у двери и не проснулась.", "Кот выпил молоко и лёг спать.",
+             "Утром кот и собака гуляли во дворе."]
+
+
+class WordTokenizer:
+    @staticmethod
+    def to_words(sentence):
+        return re.findall(r"\w+", sentence)
+
+
+def test_choose_algorithm_shares_the_budget_between_rounds(monkeypatch):
+    model = CostModel()
+    monkeypatch.setattr(summarization, "get_cost_model", lambda: model)
+    sentences, vocabulary = 1000, 2000
+    # lsa fits in the budget of a single page, but not in a quarter of it
+    budget = model.estimate("lsa", sentences, vocabulary) * 3
+    deadline = time.time() + budget
+    assert choose_algorithm(sentences, vocabulary, "lsa", deadline) == "lsa"
+    assert choose_algorithm(sentences, vocabulary, None, deadline) == "lsa"
+    fallback = choose_algorithm(sentences, vocabulary, "lsa", deadline, rounds=4)
+    assert fallback != "lsa"
+    assert model.estimate(fallback, sentences, vocabulary) <= budget / 4 * summarization.COST_SAFETY_MARGIN
+
+
+def test_chunk_rounds_count_the_shared_cores():
+    assert chunk_rounds(8, workers=8, cores=8) == 1
+    assert chunk_rounds(8, workers=4, cores=8) == 2
+    # more page processes than cores take turns on them
+    assert chunk_rounds(8, workers=8, cores=2) == 4
+    assert chunk_rounds(3, workers=8, cores=8) == 1
+
+
+def test_rank_summarizers_keep_their_names(monkeypatch):
+    monkeypatch.setattr(summarization, "load_stop_words", lambda language: ("и", "у", "во"))
+    document = ObjectDocumentModel([Paragraph([Sentence(text, WordTokenizer()) for text in SENTENCES])])
+    for algorithm, name in (("tr", "TextRank"), ("lr", "LexRank")):
+        summary, used, key = summarize_document(document, 2, algorithm=algorithm)
+        assert (used, key) == (name, algorithm)
+        assert len(summary.splitlines()) == 2
@@ -0,0 +1,115 @@
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+import http_client
+from wiki_client import MediaWikiClient
+
+ARTICLES = {"Пушкин, Александр Сергеевич": "Русский поэт.",
+            "Мир (роман)": "Роман Льва Толстого.",
+            "Мир (журнал)": "Литературный журнал.",
+            "Евгений Онегин": "Роман в стихах."}
+REDIRECTS = {"Пушкин": "Пушкин, Александр Сергеевич"}
+DISAMBIGUATIONS = {"Мир": ["Мир (значения)", "Мир (роман)", "Мир (журнал)"]}
+SEARCH = {"роман в стихах": ["Евгений Онегин"]}
+
+
+def api_response(params):
+    """Answer like the MediaWiki API, for the pages above."""
+    titles = params.get("titles")
+    if params.get("prop") == "links":
+        links = [{"ns": 0, "title": title} for title in DISAMBIGUATIONS.get(titles, [])]
+        return {"query": {"pages": [{"title": titles, "links": links}]}}
+    query = {}
+    title = REDIRECTS.get(titles, titles)
+    if title != titles:
+        query["redirects"] = [{"from": titles, "to": title}]
+    if title in DISAMBIGUATIONS:
+        page = {"title": title, "pageprops": {"disambiguation": ""}, "extract": "Мир может означать:"}
+    elif title in ARTICLES:
+        page = {"title": title, "extract": ARTICLES[title]}
+    else:
+        page = {"title": title, "missing": True}
+    query["pages"] = [page]
+    if "srsearch" in params:
+        query["search"] = [{"title": hit} for hit in SEARCH.get(params["srsearch"], [])]
+    return {"batchcomplete": True, "query": query}
+
+
+@pytest.fixture
+def api():
+    """Run a stand-in of the API on a local port, return its URL and the parameters of the requests it got."""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = dict(parse_qsl(urlsplit(self.path).query))
+            requests.append(params)
+            body = json.dumps(api_response(params), ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/w/api.php", requests
+    server.shutdown()
+    server.server_close()
+
+
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await http_client.aclose()
+    return asyncio.run(main())
+
+
+def test_article_resolves_queries(api):
+    url, requests = api
+    client = MediaWikiClient(api_url=url)
+
+    async def main():
+        assert await client.article("Пушкин") == ("Пушкин, Александр Сергеевич", "Русский поэт.")
+        assert requests[-1]["redirects"] == "1"
+        # the links are only asked for the disambiguation page
+        assert "links" not in requests[-1]["prop"]
+
+        title, extract = await client.article("Мир")
+        assert (title, extract) in {("Мир (роман)", ARTICLES["Мир (роман)"]),
+                                    ("Мир (журнал)", ARTICLES["Мир (журнал)"])}
+        assert [params["prop"] for params in requests[-3:]] == ["extracts|pageprops", "links", "extracts|pageprops"]
+
+        assert await client.article("роман в стихах") == ("Евгений Онегин", "Роман в стихах.")
+        assert requests[-1]["titles"] == "Евгений Онегин"
+
+        assert await client.article("Несуществующая страница") is None
+
+    run(main())
+
+
+def test_article_is_cached_for_ttl(api):
+    url, requests = api
+    client = MediaWikiClient(api_url=url, ttl=0.5)
+
+    async def main():
+        for _ in range(2):
+            assert await client.article("https://ru.wikipedia.org/wiki/Евгений_Онегин") == ("Евгений Онегин",
+                                                                                          "Роман в стихах.")
+        assert len(requests) == 1
+        await asyncio.sleep(0.6)
+        assert await client.article("Евгений Онегин") == ("Евгений Онегин", "Роман в стихах.")
+        assert len(requests) == 2
+
+    run(main())
@@ -0,0 +1,131 @@
+"""MediaWiki API client behind /wikipedia and the Wikipedia summaries.
+
+A query is resolved in one API call that asks for the page (following redirects), its plain-text extract,
+whether it is a disambiguation page and the best search hit at once. More calls are only needed for a page
+picked from the search results, or for the links of a disambiguation page and a page picked from them.
+The calls are made from the bot's coroutines.
+"""
+
+import random
+import logging
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import http_client
+from caching import LRUCache
+from setup import WIKIPEDIA_API_URL, WIKIPEDIA_USER_AGENT, WIKIPEDIA_CACHE_SIZE, WIKIPEDIA_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Pages picked from a disambiguation page that are tried before giving up
+DISAMBIGUATION_ATTEMPTS = 3
+# Links of a disambiguation page that aren't meanings of the word
+NOT_MEANINGS = ("(значения)",)
+
+
+class WikipediaError(Exception):
+    pass
+
+
+def title_from_url(url: str):
+    """Return the title of the article the Wikipedia URL points to."""
+    parts = urlsplit(url)
+    if parts.path.startswith("/wiki/"):
+        title = parts.path.removeprefix("/wiki/")
+    else:
+        title = parse_qs(parts.query).get("title", [""])[0]
+    return unquote(title).replace("_", " ")
+
+
+class MediaWikiClient:
+    """Resolves queries to articles and fetches their plain text, caching both for ttl seconds."""
+
+    def __init__(self, api_url=WIKIPEDIA_API_URL, cache_size=WIKIPEDIA_CACHE_SIZE, ttl=WIKIPEDIA_CACHE_TTL):
+        self.api_url = api_url
+        # query -> title, and title -> extract
+        self.titles = LRUCache(maxsize=cache_size, ttl=ttl)
+        self.extracts = LRUCache(maxsize=cache_size, ttl=ttl)
+
+    async def request(self, **params):
+        params = {"action": "query", "format": "json", "formatversion": 2, **params}
+        response = await http_client.aget(self.api_url, params=params, headers={"User-Agent": WIKIPEDIA_USER_AGENT})
+        data = response.json()
+        if "error" in data:
+            raise WikipediaError(data["error"].get("info", data["error"]))
+        return data
+
+    async def query_pages(self, **params):
+        """Request the pages with their extracts and disambiguation flags."""
+        data = await self.request(prop="extracts|pageprops", explaintext=1, exsectionformat="wiki",
+                                  ppprop="disambiguation", redirects=1, **params)
+        return data, data.get("query", {}).get("pages", [])
+
+    async def links(self, title: str):
+        """Return the titles of the articles the page links to."""
+        data = await self.request(prop="links", titles=title, plnamespace=0, pllimit="max")
+        return [link["title"] for page in data.get("query", {}).get("pages", []) for link in page.get("links", [])]
+
+    def page(self, pages):
+        """Return the first existing page of the response, remembering its extract unless it's a disambiguation."""
+        for page in pages:
+            if page.get("missing") or page.get("invalid"):
+                continue
+            if not self.is_disambiguation(page):
+                self.extracts.set(page["title"], page.get("extract", ""))
+            return page
+        return None
+
+    @staticmethod
+    def is_disambiguation(page):
+        return "disambiguation" in page.get("pageprops", {})
+
+    async def resolve(self, page):
+        """Return the title and extract of the page, or of a meaning picked from it if it's a disambiguation page."""
+        if not self.is_disambiguation(page):
+            return page["title"], page.get("extract", "")
+        meanings = [title for title in await self.links(page["title"])
+                    if all(item not in title for item in NOT_MEANINGS)]
+        random.shuffle(meanings)
+        for title in meanings[:DISAMBIGUATION_ATTEMPTS]:
+            _, pages = await self.query_pages(titles=title)
+            meaning = self.page(pages)
+            if meaning is not None and not self.is_disambiguation(meaning):
+                return meaning["title"], meaning.get("extract", "")
+        raise WikipediaError(f"no article among the meanings of {page['title']}")
+
+    async def random_article(self):
+        _, pages = await self.query_pages(generator="random", grnnamespace=0, grnlimit=1)
+        page = self.page(pages)
+        if page is None:
+            raise WikipediaError("no random article")
+        return await self.resolve(page)
+
+    async def article(self, query: str):
+        """Return the title and plain text of the article for the query, a title or a Wikipedia URL.
+
+        Returns None if there's neither such a page nor a search result.
+        """
+        if "wikipedia.org" in query:
+            query = title_from_url(query)
+        title = self.titles.get(query)
+        if title is not None:
+            extract = self.extracts.get(title)
+            if extract is not None:
+                return title, extract
+
+        data, pages = await self.query_pages(titles=query, list="search", srsearch=query, srlimit=1, srnamespace=0)
+        page = self.page(pages)
+        if page is None:
+            hits = data.get("query", {}).get("search", [])
+            if not hits:
+                return None
+            _, pages = await self.query_pages(titles=hits[0]["title"])
+            page = self.page(pages)
+            if page is None:
+                return None
+        title, extract = await self.resolve(page)
+        self.titles.set(query, title)
+        self.extracts.set(title, extract)
+        return title, extract
+
+
+WIKIPEDIA = MediaWikiClient()
@@ -0,0 +1,281 @@
+"""Worker processes for the CPU-heavy NLP jobs.
+
+The handlers submit jobs and await the returned futures, so a long parse or summary
+runs in its own process instead of holding the GIL of the bot's process and blocking its event loop.
+Summaries run in a DeadlineExecutor, whose processes are killed when they run out of time.
+"""
+
+import os
+import time
+import asyncio
+import signal
+import atexit
+import logging
+import threading
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from natasha import Doc
+
+import models
+from check_dic import correct_many, get_index
+from sentence_analysis import ANALYSIS_CACHE, SentencePipeline
+from summarization import chunked_summarization, preload, summarization
+from setup import NLP_WORKERS, SUMMARY_WORKERS, DOCUMENT_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Worker processes are started from a clean server process rather than forked from the
+# multithreaded bot process where possible
+MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Wall-clock and CPU seconds a DeadlineExecutor job took, CPU time includes the processes it started
+JobStats = namedtuple("JobStats", ["elapsed", "cpu_time"])
+
+# How many affinity keys a DeadlineExecutor worker remembers, as many as it caches documents
+AFFINITIES_PER_WORKER = DOCUMENT_CACHE_SIZE
+
+_POOL = None
+
+
+class JobTimeout(Exception):
+    """The job didn't finish before its deadline and its process was killed."""
+
+
+def _cpu_time():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _deadline_worker(conn, initializer):
+    """Run the jobs received through the pipe until it is closed."""
+    if hasattr(os, "setpgrp"):
+        # lead a process group, so that killing the group also kills the processes the jobs start
+        os.setpgrp()
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        job, args = message
+        cpu_start = _cpu_time()
+        try:
+            reply = ("ok", job(*args))
+        except Exception as error:
+            reply = ("error", error)
+        try:
+            conn.send((*reply, _cpu_time() - cpu_start))
+        except Exception as error:
+            # the result or the exception can't be pickled
+            conn.send(("error", RuntimeError(repr(error)), _cpu_time() - cpu_start))
+
+
+class _DeadlineWorker:
+    def __init__(self, initializer):
+        # affinity keys of the latest jobs, the worker is likely to have their data cached
+        self.affinities = deque(maxlen=AFFINITIES_PER_WORKER)
+        self.conn, child_conn = MP_CONTEXT.Pipe()
+        self.process = MP_CONTEXT.Process(target=_deadline_worker, args=(child_conn, initializer),
+                                          name="deadline-worker")
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (AttributeError, OSError):
+            # no process groups on this platform, or the worker hasn't set its group up yet
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class DeadlineExecutor:
+    """Runs jobs in reusable child processes and kills a child when its job misses the deadline.
+
+    At most `workers` jobs run at once; waiting for a free worker counts towards the deadline,
+    so under load the jobs time out instead of piling up. Jobs with the same affinity key
+    go to the same worker when it is idle, so that they can reuse what it has cached.
+    """
+
+    def __init__(self, workers=SUMMARY_WORKERS, initializer=None):
+        self.workers = workers
+        self.initializer = initializer
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers)
+        # created on the bot's event loop by the first arun()
+        self._async_slots = None
+
+    def start(self):
+        """Start the worker processes ahead of the first job."""
+        started = [_DeadlineWorker(self.initializer) for _ in range(self.workers - len(self._idle))]
+        with self._idle_lock:
+            self._idle.extend(started)
+
+    def _get_worker(self, affinity=None):
+        """Return an idle live worker, preferring one that ran a job with the affinity key."""
+        while True:
+            with self._idle_lock:
+                if not self._idle:
+                    break
+                index = next((index for index, worker in enumerate(self._idle) if affinity in worker.affinities),
+                             len(self._idle) - 1)
+                worker = self._idle.pop(index)
+            if worker.process.is_alive():
+                return worker
+            worker.kill()
+        return _DeadlineWorker(self.initializer)
+
+    def run(self, job, args, timeout, affinity=None):
+        """Run job(*args) in a worker process and return its result and JobStats.
+
+        Raises JobTimeout if the job doesn't finish within timeout seconds, and re-raises the job's exceptions.
+        """
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=timeout):
+            raise JobTimeout(f"no free worker within {timeout} s")
+        try:
+            worker = self._get_worker(affinity)
+            try:
+                worker.conn.send((job, args))
+                remaining = max(timeout - (time.perf_counter() - start), 0)
+                if not worker.conn.poll(remaining):
+                    worker.kill()
+                    elapsed = time.perf_counter() - start
+                    logger.warning(f"{job.__name__} missed its {timeout} s deadline, killed after {elapsed:.1f} s")
+                    raise JobTimeout(f"{job.__name__} took longer than {timeout} s")
+                status, payload, cpu_time = worker.conn.recv()
+            except (EOFError, OSError):
+                worker.kill()
+                raise RuntimeError(f"the worker running {job.__name__} died")
+            if affinity is not None:
+                worker.affinities.append(affinity)
+            with self._idle_lock:
+                self._idle.append(worker)
+        finally:
+            self._slots.release()
+
+        stats = JobStats(time.perf_counter() - start, cpu_time)
+        logger.info(f"{job.__name__} took {stats.elapsed:.2f} s, {stats.cpu_time:.2f} s of CPU")
+        if status == "error":
+            raise payload
+        return payload, stats
+
+    async def arun(self, job, args, timeout, affinity=None):
+        """run() for coroutines.
+
+        The jobs wait for a free worker on the event loop, only the running ones hold a thread of the loop's executor.
+        """
+        start = time.perf_counter()
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.workers)
+        try:
+            await asyncio.wait_for(self._async_slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise JobTimeout(f"no free worker within {timeout} s") from None
+        try:
+            remaining = max(timeout - (time.perf_counter() - start), 0)
+            return await asyncio.get_running_loop().run_in_executor(None, self.run, job, args, remaining, affinity)
+        finally:
+            self._async_slots.release()
+
+    def shutdown(self):
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+
+SUMMARY_EXECUTOR = DeadlineExecutor(SUMMARY_WORKERS, initializer=preload)
+atexit.register(SUMMARY_EXECUTOR.shutdown)
+
+
+def _preload():
+    """Load every model the NLP jobs need once per worker process."""
+    models.warmup(background=False)
+    get_index()
+
+
+def start(workers=NLP_WORKERS):
+    """Start the worker processes and wait until they have loaded their models."""
+    global _POOL
+    if _POOL is None:
+        _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=MP_CONTEXT, initializer=_preload)
+        for future in [_POOL.submit(_ready) for _ in range(workers)]:
+            future.result()
+        SUMMARY_EXECUTOR.start()
+        logger.info(f"Started {workers} NLP workers and {SUMMARY_EXECUTOR.workers} summarization workers")
+    return _POOL
+
+
+def shutdown():
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown(cancel_futures=True)
+        _POOL = None
+    SUMMARY_EXECUTOR.shutdown()
+
+
+def submit(job, *args):
+    """Run the job in a worker process and return its future."""
+    return start().submit(job, *args)
+
+
+async def run(job, *args):
+    """Run the job in a worker process and return its result, without blocking the event loop."""
+    return await asyncio.wrap_future(submit(job, *args))
+
+
+def _ready():
+    return True
+
+
+# Jobs: module-level functions with picklable arguments and results
+
+
+def analyse_sentence(sent: str, lemmatization=True, morph_analysis=True, synt_analysis=True):
+    """Return the lemmas, morphology and syntax messages and the syntax tree PNG of the sentence."""
+    pipeline = SentencePipeline(lemmatization, morph_analysis, synt_analysis)
+    result = pipeline.run(sent)
+    logger.info(f"/sentence stages took {pipeline.timings}, cache: {ANALYSIS_CACHE.stats()}")
+    return result
+
+
+def spellcheck(sent: str):
+    """Return (token, correction, whether the token was correct) for every token of the sentence."""
+    doc = Doc(sent)
+    doc.segment(models.segmenter())
+    tokens = [token.text for token in doc.tokens]
+    return [(word, right_word, flag) for word, (right_word, flag) in zip(tokens, correct_many(tokens))]
+
+
+def summarize(text: str, n_sents: int, language="russian", algorithm=None, num_pages=1, source=None, deadline=None):
+    """Return the summary of the text, the name of the algorithm used and its ALGORITHMS key.
+
+    Texts of several pages are summarized page by page in parallel first.
+    The parsed text is kept for the next summaries of the same source with any algorithm, by the worker,
+    or page by page by its page processes for the texts of several pages.
+    Without a known algorithm, or when it would miss the deadline (a time.time() value), the algorithm
+    is chosen by the measured costs.
+    """
+    if num_pages > 1:
+        return chunked_summarization(text, n_sents, num_pages, language, algorithm, source, deadline)
+    return summarization(text, n_sents, language, algorithm, source, deadline)